@@ -4,7 +4,10 @@
 import asyncio
 import json
 import logging
+import time
+from collections import defaultdict
 from datetime import timedelta
+from typing import Callable, Dict, Iterable, List, Set, Tuple  # noqa
 
 import voluptuous as vol
 
@@ -12,18 +15,37 @@ import homeassistant.helpers.config_validation as cv
 from homeassistant import config_entries
 from homeassistant.components import persistent_notification
 from homeassistant.const import CONF_NAME
+from homeassistant.core import callback
 from homeassistant.helpers.event import async_track_time_interval
 
+from .auth import NibeTokenManager
+from .cache import NibeParameterCache
+from .client import NibeClient
 from .config import NibeConfigFlow  # noqa
+from .fetcher import NibeFetcher
+from .scheduler import NibeScheduler
+from .session import async_get_metrics, async_use_session
+from .thermostat import NibeThermostatPublisher
+from .writer import NibeWriter
 from .const import (CONF_ACCESS_DATA, CONF_BINARY_SENSORS, CONF_CATEGORIES,
                     CONF_CLIENT_ID, CONF_CLIENT_SECRET, CONF_CLIMATE_SYSTEMS,
-                    CONF_CLIMATES, CONF_CURRENT_TEMPERATURE, CONF_REDIRECT_URI,
+                    CONF_CLIMATES, CONF_CONNECTION_LIMIT,
+                    CONF_CURRENT_TEMPERATURE, CONF_KEEPALIVE_TIMEOUT,
+                    CONF_REQUEST_TIMEOUT, CONNECTION_LIMIT, KEEPALIVE_TIMEOUT,
+                    REQUEST_TIMEOUT,
+                    CONF_MAX_INTERVAL, CONF_REDIRECT_URI,
                     CONF_SENSORS, CONF_STATUSES, CONF_SWITCHES, CONF_SYSTEM,
                     CONF_SYSTEMS, CONF_THERMOSTATS, CONF_UNIT, CONF_UNITS,
                     CONF_VALVE_POSITION, CONF_WATER_HEATERS, CONF_WRITEACCESS,
-                    DATA_NIBE, DOMAIN, SCAN_INTERVAL,
-                    SERVICE_SET_SMARTHOME_MODE, SIGNAL_PARAMETERS_UPDATED,
-                    SIGNAL_STATUSES_UPDATED, SERVICE_SET_PARAMETER)
+                    SETUP_TIMEOUT, UPDATE_TIMEOUT,
+                    DATA_NIBE, DOMAIN, MAX_INTERVAL, PRIORITY_NORMAL,
+                    SCAN_INTERVAL,
+                    SERVICE_SET_SMARTHOME_MODE, SIGNAL_STATUSES_UPDATED,
+                    SERVICE_SET_PARAMETER, SERVICE_APPLY_PARAMETERS,
+                    SERVICE_DUMP_METRICS,
+                    SNAPSHOT_INTERVAL, EVENT_PARAMETERS_APPLIED,
+                    STORAGE_KEY_SCHEDULE, STORAGE_KEY_SNAPSHOT,
+                    STORAGE_SAVE_DELAY, STORAGE_VERSION)
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -67,6 +89,8 @@ SYSTEM_SCHEMA = vol.Schema({
         vol.All(cv.ensure_list, [cv.string]),
     vol.Optional(CONF_THERMOSTATS, default={}):
         {cv.positive_int: THERMOSTAT_SCHEMA},
+    vol.Optional(CONF_MAX_INTERVAL, default=MAX_INTERVAL):
+        vol.All(cv.positive_int, vol.Range(min=SCAN_INTERVAL)),
 })
 
 NIBE_SCHEMA = vol.Schema({
@@ -76,6 +100,12 @@ NIBE_SCHEMA = vol.Schema({
     vol.Optional(CONF_WRITEACCESS): cv.boolean,
     vol.Optional(CONF_SYSTEMS, default=[]):
         vol.All(cv.ensure_list, [SYSTEM_SCHEMA]),
+    vol.Optional(CONF_CONNECTION_LIMIT, default=CONNECTION_LIMIT):
+        cv.positive_int,
+    vol.Optional(CONF_KEEPALIVE_TIMEOUT, default=KEEPALIVE_TIMEOUT):
+        cv.positive_int,
+    vol.Optional(CONF_REQUEST_TIMEOUT, default=REQUEST_TIMEOUT):
+        cv.positive_int,
 })
 
 CONFIG_SCHEMA = vol.Schema({
@@ -111,12 +141,33 @@ async def async_setup_systems(hass, uplink, entry):
         for config in config.get(CONF_SYSTEMS)
     }
 
+    async def load(system):
+        try:
+            await asyncio.wait_for(system.load(), SETUP_TIMEOUT)
+        except asyncio.TimeoutError:
+            _LOGGER.error("Timeout loading system %s", system.system_id)
+            del systems[system.system_id]
+        except Exception as exception:
+            _LOGGER.error("Error loading system %s: %s",
+                          system.system_id, exception)
+            del systems[system.system_id]
+
     hass.data[DATA_NIBE]['systems'] = systems
     hass.data[DATA_NIBE]['uplink'] = uplink
 
-    tasks = [system.load() for system in systems.values()]
+    await asyncio.gather(*[
+        load(system) for system in list(systems.values())
+    ])
+
+    async def update(now):
+        await asyncio.gather(*[
+            system.update() for system in systems.values()
+        ])
 
-    await asyncio.gather(*tasks)
+    hass.data[DATA_NIBE]['unsub_update'] = async_track_time_interval(
+        hass,
+        update,
+        timedelta(seconds=SCAN_INTERVAL))
 
     for platform in FORWARD_PLATFORMS:
         hass.async_add_job(hass.config_entries.async_forward_entry_setup(
@@ -136,9 +187,8 @@ async def async_register_services(hass):
         )
 
     async def set_parameter(call):
-        uplink = hass.data[DATA_NIBE]['uplink']
-        await uplink.put_parameter(
-            call.data['system'],
+        system = hass.data[DATA_NIBE]['systems'][call.data['system']]
+        system.writer.async_write(
             call.data['parameter'],
             call.data['value'])
 
@@ -147,12 +197,110 @@ async def async_register_services(hass):
         vol.Required('mode'): vol.In(SMARTHOME_MODES.values())
     })
 
+    async def apply_parameters(call):
+        """Write a set of parameters, optionally undoing it on failure.
+
+        Writes queued together are sent to uplink in a single request.
+        """
+        system = hass.data[DATA_NIBE]['systems'][call.data['system']]
+        parameters = call.data['parameters']
+
+        originals = {}
+        for parameter_id in parameters:
+            record = system.cache.get(parameter_id)
+            if record is not None and record.value is not None:
+                originals[parameter_id] = _format_value(record.value)
+
+        results = await asyncio.gather(*[
+            system.writer.async_write(parameter_id, value)
+            for parameter_id, value in parameters.items()
+        ], return_exceptions=True)
+
+        statuses = {}
+        failed = set()
+        for parameter_id, result in zip(parameters.keys(), results):
+            if isinstance(result, Exception):
+                failed.add(parameter_id)
+                result = str(result)
+            statuses[parameter_id] = result
+
+        rolled_back = []
+        if failed and call.data['rollback']:
+            rolled_back = [
+                parameter_id
+                for parameter_id in parameters.keys()
+                if parameter_id not in failed and parameter_id in originals
+            ]
+            _LOGGER.warning("Rolling back parameters %s of system %s",
+                            rolled_back, system.system_id)
+            await asyncio.gather(*[
+                system.writer.async_write(parameter_id,
+                                          originals[parameter_id])
+                for parameter_id in rolled_back
+            ], return_exceptions=True)
+
+        hass.bus.async_fire(EVENT_PARAMETERS_APPLIED, {
+            'system': system.system_id,
+            'results': statuses,
+            'rolled_back': rolled_back,
+        })
+
+    async def dump_metrics(call):
+        """Show request metrics in a notification."""
+        uplink = hass.data[DATA_NIBE].get('uplink')
+        if uplink is None:
+            _LOGGER.warning("No metrics, nibe uplink is not set up")
+            return
+
+        data = {
+            'inflight': uplink.inflight,
+            'queue_depth': uplink.queue_depth,
+            'writes_pending': {
+                system_id: system.writer.queue_depth
+                for system_id, system in hass.data[DATA_NIBE].get(
+                    'systems', {}).items()
+            },
+            'endpoints': async_get_metrics(hass).dump(),
+        }
+        msg = json.dumps(data, indent=1)
+        _LOGGER.info("Request metrics: %s", msg)
+        persistent_notification.async_create(
+            hass,
+            '<pre>{}</pre>'.format(msg),
+            'Nibe uplink metrics',
+            'nibe_metrics')
+
+    def valid_system(system_id):
+        systems = hass.data[DATA_NIBE].get('systems', {})
+        if system_id not in systems:
+            raise vol.Invalid('System {} is not loaded'.format(system_id))
+        return system_id
+
     SERVICE_SET_PARAMETER_SCHEMA = vol.Schema({
-        vol.Required('system'): cv.positive_int,
+        vol.Required('system'): vol.All(cv.positive_int, valid_system),
         vol.Required('parameter'): cv.string,
         vol.Required('value'): cv.string
     })
 
+    def known_parameters(data):
+        system = hass.data[DATA_NIBE]['systems'][data['system']]
+        unknown = [
+            parameter_id
+            for parameter_id in data['parameters']
+            if system.cache.get(parameter_id) is None
+        ]
+        if unknown:
+            raise vol.Invalid('Unknown parameters {} of system {}'.format(
+                ', '.join(unknown), data['system']))
+        return data
+
+    SERVICE_APPLY_PARAMETERS_SCHEMA = vol.All(vol.Schema({
+        vol.Required('system'): vol.All(cv.positive_int, valid_system),
+        vol.Required('parameters'): vol.All(
+            {cv.string: cv.string}, vol.Length(min=1)),
+        vol.Optional('rollback', default=False): cv.boolean,
+    }), known_parameters)
+
     hass.services.async_register(
         DOMAIN,
         SERVICE_SET_SMARTHOME_MODE,
@@ -162,9 +310,20 @@ async def async_register_services(hass):
     hass.services.async_register(
         DOMAIN,
         SERVICE_SET_PARAMETER,
-        set_smarthome_mode,
+        set_parameter,
         SERVICE_SET_PARAMETER_SCHEMA)
 
+    hass.services.async_register(
+        DOMAIN,
+        SERVICE_APPLY_PARAMETERS,
+        apply_parameters,
+        SERVICE_APPLY_PARAMETERS_SCHEMA)
+
+    hass.services.async_register(
+        DOMAIN,
+        SERVICE_DUMP_METRICS,
+        dump_metrics)
+
 
 async def async_setup(hass, config):
     """Configure the nibe uplink component."""
@@ -199,22 +358,24 @@ async def async_setup_entry(hass, entry: config_entries.ConfigEntry):
     else:
         scope = ['READSYSTEM']
 
-    def access_data_write(data):
-        hass.config_entries.async_update_entry(
-            entry, data={
-                **entry.data, CONF_ACCESS_DATA: data
-            })
+    tokens = NibeTokenManager(hass, entry)
 
     uplink = Uplink(
         client_id=entry.data.get(CONF_CLIENT_ID),
         client_secret=entry.data.get(CONF_CLIENT_SECRET),
         redirect_uri=entry.data.get(CONF_REDIRECT_URI),
         access_data=entry.data.get(CONF_ACCESS_DATA),
-        access_data_write=access_data_write,
+        access_data_write=tokens.access_data_write,
         scope=scope
     )
+    await async_use_session(hass,
+                            uplink,
+                            entry.data.get(CONF_CLIENT_ID),
+                            entry.data.get(CONF_CLIENT_SECRET))
+    tokens.async_start(uplink)
+    hass.data[DATA_NIBE]['tokens'] = tokens
 
-    await uplink.refresh_access_token()
+    uplink = NibeClient(uplink)
 
     await async_setup_systems(hass, uplink, entry)
 
@@ -223,6 +384,10 @@ async def async_setup_entry(hass, entry: config_entries.ConfigEntry):
 
 async def async_unload_entry(hass, entry):
     """Unload a configuration entity."""
+    unsub_update = hass.data[DATA_NIBE].pop('unsub_update', None)
+    if unsub_update:
+        unsub_update()
+
     await asyncio.wait([
         hass.config_entries.async_forward_entry_unload(
             entry, platform)
@@ -234,6 +399,7 @@ async def async_unload_entry(hass, entry):
         for system in hass.data[DATA_NIBE]['systems'].values()
     ])
 
+    hass.data[DATA_NIBE].pop('tokens').async_stop()
     await hass.data[DATA_NIBE]['uplink'].close()
     del hass.data[DATA_NIBE]['systems']
     del hass.data[DATA_NIBE]['uplink']
@@ -251,9 +417,129 @@ class NibeSystem(object):
         self.entry_id = entry_id
         self.system = None
         self.uplink = uplink
-        self.notice = []
+        self.fetcher = NibeFetcher(uplink, system_id)
+        self.cache = NibeParameterCache(system_id)
+        self.thermostats = NibeThermostatPublisher(hass, uplink, system_id)
+        self.writer = NibeWriter(hass, self)
+        self.scheduler = NibeScheduler(SCAN_INTERVAL,
+                                       config[CONF_MAX_INTERVAL])
+        self._schedule_store = hass.helpers.storage.Store(
+            STORAGE_VERSION, STORAGE_KEY_SCHEDULE.format(system_id))
+        self._snapshot_store = hass.helpers.storage.Store(
+            STORAGE_VERSION, STORAGE_KEY_SNAPSHOT.format(system_id))
+        self._snapshot_due = None
+        self.notice = {}  # type: Dict[int, Tuple[str, str]]
         self.statuses = set()
         self._device_info = {}
+        self._listeners = defaultdict(list)  # type: Dict[str, List[Callable]]
+        self._status_hash = None
+        self._status_keys = set()  # type: Set[str]
+        self._notice_hash = None
+
+    @callback
+    def async_add_listener(self,
+                           parameter_ids: Iterable,
+                           listener: Callable[[Set[str]], None]):
+        """Retrieve parameters and call listener when they are updated."""
+        keys = set(str(parameter_id) for parameter_id in parameter_ids)
+        now = time.monotonic()
+        for key in keys:
+            self._listeners[key].append(listener)
+            # values restored from a snapshot are polled right away
+            if self.cache.restored(key):
+                fetched = None
+            else:
+                fetched = self.cache.fetched(key)
+            self.scheduler.add(key, fetched, now)
+
+        @callback
+        def remove_listener():
+            for key in keys:
+                self._listeners[key].remove(listener)
+                if not self._listeners[key]:
+                    del self._listeners[key]
+                    self.scheduler.remove(key)
+
+        return remove_listener
+
+    async def get_parameters(self, parameter_ids: Iterable, force=False,
+                             priority=PRIORITY_NORMAL):
+        """Return parameters from cache, fetching missing or stale ones.
+
+        Forced requests fetch all parameters anew, without joining any
+        request already in flight.
+        """
+        parameter_ids = list(parameter_ids)
+        if force:
+            missing = parameter_ids
+        else:
+            missing = self.cache.stale(parameter_ids)
+
+        if missing:
+            self.parameters_received(
+                await self.fetcher.get_parameters(missing, priority,
+                                                  fresh=force))
+
+        return {
+            parameter_id: self.cache.get(parameter_id)
+            for parameter_id in parameter_ids
+        }
+
+    def parameters_unchanged(self, parameter_ids: Iterable):
+        """Register parameters received again with identical data."""
+        now = time.monotonic()
+        rescheduled = False
+        for parameter_id in parameter_ids:
+            key = str(parameter_id)
+            rescheduled |= self.scheduler.observe(key, False)
+            self.scheduler.schedule(key, now)
+        self.cache.touch(parameter_ids, now)
+
+        if rescheduled:
+            self._schedule_store.async_delay_save(
+                self.scheduler.save, STORAGE_SAVE_DELAY)
+
+    def parameters_received(self, parameters):
+        """Store received parameters and notify entities."""
+        # values read before a write lands would undo the optimistic ones
+        parameters = {
+            parameter_id: data
+            for parameter_id, data in parameters.items()
+            if not self.writer.busy(parameter_id)
+        }
+        now = time.monotonic()
+        rescheduled = False
+        for parameter_id, data in parameters.items():
+            key = str(parameter_id)
+            if key in self.cache:
+                rescheduled |= self.scheduler.observe(
+                    key, self.cache.differs(key, data))
+            self.scheduler.schedule(key, now)
+
+        if rescheduled:
+            self._schedule_store.async_delay_save(
+                self.scheduler.save, STORAGE_SAVE_DELAY)
+
+        keys = self.cache.update(parameters, now)
+        self._notify(keys)
+        return keys
+
+    @callback
+    def parameters_written(self, records):
+        """Apply records of written parameters and notify entities."""
+        for key, record in records.items():
+            self.cache.replace(key, record)
+        self._notify(records.keys())
+
+    def _notify(self, keys: Iterable[str]):
+        """Call listeners of parameters once each."""
+        listeners = {}  # type: Dict[Callable, Set[str]]
+        for key in keys:
+            for listener in self._listeners.get(key, ()):
+                listeners.setdefault(listener, set()).add(key)
+
+        for listener, updated in listeners.items():
+            listener(updated)
 
     @property
     def device_info(self):
@@ -262,13 +548,29 @@ class NibeSystem(object):
 
     async def unload(self):
         """Unload system."""
-        pass
+        await self._snapshot_store.async_save(self.cache.snapshot())
+
+    async def save_snapshot(self):
+        """Save parameter values periodically, and at shutdown."""
+        now = time.monotonic()
+        if now >= self._snapshot_due:
+            self._snapshot_due = now + SNAPSHOT_INTERVAL
+            await self._snapshot_store.async_save(self.cache.snapshot())
+        else:
+            self._snapshot_store.async_delay_save(
+                self.cache.snapshot, SNAPSHOT_INTERVAL)
 
     async def load(self):
         """Load system."""
         self.system = await self.uplink.get_system(self.system_id)
         _LOGGER.debug("Loading system: {}".format(self.system))
 
+        self.scheduler.load(await self._schedule_store.async_load())
+
+        # values restored are stale, so they are refreshed when first due
+        self.cache.restore(await self._snapshot_store.async_load())
+        self._snapshot_due = time.monotonic() + SNAPSHOT_INTERVAL
+
         self._device_info = {
             'identifiers': {(DOMAIN, self.system_id)},
             'manufacturer': "NIBE Energy Systems",
@@ -284,14 +586,28 @@ class NibeSystem(object):
         )
 
         await self.update()
-        async_track_time_interval(
-            self.hass,
-            self.update,
-            timedelta(seconds=SCAN_INTERVAL))
+
+    async def update_parameters(self):
+        """Update registered parameters that are due for polling."""
+        parameter_ids = self.scheduler.pop_due(time.monotonic())
+        self.parameters_received(
+            await asyncio.wait_for(
+                self.fetcher.get_parameters(parameter_ids),
+                UPDATE_TIMEOUT))
 
     async def update_statuses(self):
         """Update status list."""
-        status_icons = await self.uplink.get_status(self.system_id)
+        status_icons = await asyncio.wait_for(
+            self.uplink.get_status(self.system_id),
+            UPDATE_TIMEOUT)
+
+        status_hash = _payload_hash(status_icons)
+        if status_hash == self._status_hash:
+            _LOGGER.debug("Statuses unchanged for %s", self.system_id)
+            self.parameters_unchanged(self._status_keys)
+            return
+        self._status_hash = status_hash
+
         parameters = {}
         statuses = set()
         for status_icon in status_icons:
@@ -301,33 +617,102 @@ class NibeSystem(object):
         self.statuses = statuses
         _LOGGER.debug("Statuses: %s", statuses)
 
-        self.hass.helpers.dispatcher.async_dispatcher_send(
-            SIGNAL_PARAMETERS_UPDATED, parameters)
+        self._status_keys = self.parameters_received(parameters)
 
         self.hass.helpers.dispatcher.async_dispatcher_send(
-            SIGNAL_STATUSES_UPDATED, statuses)
+            SIGNAL_STATUSES_UPDATED.format(self.system_id), statuses)
 
     async def update_notifications(self):
         """Update notification list."""
-        notice = await self.uplink.get_notifications(self.system_id)
-        added = [k for k in notice if k not in self.notice]
-        removed = [k for k in self.notice if k not in notice]
-        self.notice = notice
-
-        for x in added:
-            persistent_notification.async_create(
-                self.hass,
-                x['info']['description'],
-                x['info']['title'],
-                'nibe:{}'.format(x['notificationId'])
-            )
-        for x in removed:
-            persistent_notification.async_dismiss(
-                self.hass,
-                'nibe:{}'.format(x['notificationId'])
-            )
+        notice = await asyncio.wait_for(
+            self.uplink.get_notifications(self.system_id),
+            UPDATE_TIMEOUT)
+
+        notice_hash = _payload_hash(notice)
+        if notice_hash == self._notice_hash:
+            return
+        self._notice_hash = notice_hash
+
+        notices = {
+            x['notificationId']: (x['info']['title'],
+                                  x['info']['description'])
+            for x in notice
+        }
+        create = {
+            notification_id: info
+            for notification_id, info in notices.items()
+            if self.notice.get(notification_id) != info
+        }
+        dismiss = self.notice.keys() - notices.keys()
+        self.notice = notices
+
+        if create or dismiss:
+            self.hass.async_create_task(
+                self._async_apply_notices(create, dismiss))
+
+    async def _async_apply_notices(self, create, dismiss):
+        """Create and dismiss persistent notifications in one batch."""
+        calls = [
+            self.hass.services.async_call(
+                persistent_notification.DOMAIN,
+                persistent_notification.SERVICE_CREATE, {
+                    persistent_notification.ATTR_TITLE: title,
+                    persistent_notification.ATTR_MESSAGE: description,
+                    persistent_notification.ATTR_NOTIFICATION_ID:
+                        'nibe:{}'.format(notification_id),
+                })
+            for notification_id, (title, description) in create.items()
+        ]
+        calls.extend(
+            self.hass.services.async_call(
+                persistent_notification.DOMAIN,
+                persistent_notification.SERVICE_DISMISS, {
+                    persistent_notification.ATTR_NOTIFICATION_ID:
+                        'nibe:{}'.format(notification_id),
+                })
+            for notification_id in dismiss
+        )
+        await asyncio.gather(*calls)
 
     async def update(self, now=None):
         """Update system state."""
-        await self.update_notifications()
-        await self.update_statuses()
+        async def update_statuses_and_parameters():
+            # parameters included in statuses need no separate poll, those
+            # of statuses failing to update are polled once due
+            try:
+                await self.update_statuses()
+            except asyncio.TimeoutError:
+                _LOGGER.warning("Timeout updating statuses of system %s",
+                                self.system_id)
+            except Exception as exception:
+                _LOGGER.error("Error updating statuses of system %s: %s",
+                              self.system_id, exception)
+            await self.update_parameters()
+
+        results = await asyncio.gather(
+            self.update_notifications(),
+            update_statuses_and_parameters(),
+            self.thermostats.async_publish(),
+            return_exceptions=True)
+
+        for result in results:
+            if isinstance(result, asyncio.TimeoutError):
+                _LOGGER.warning("Timeout updating system %s",
+                                self.system_id)
+            elif isinstance(result, Exception):
+                _LOGGER.error("Error updating system %s: %s",
+                              self.system_id, result)
+
+        await self.save_snapshot()
+
+
+def _format_value(value) -> str:
+    """Return a parameter value in the form it is written."""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def _payload_hash(data) -> int:
+    """Return a hash of a json payload."""
+    return hash(json.dumps(data, sort_keys=True))
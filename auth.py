@@ -0,0 +1,160 @@
+"""Access token management for nibe uplink."""
+
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Optional  # noqa
+
+from homeassistant.const import EVENT_HOMEASSISTANT_STOP
+from homeassistant.core import callback
+from homeassistant.util import dt as dt_util
+
+from .const import (CONF_ACCESS_DATA, TOKEN_REFRESH_MARGIN,
+                    TOKEN_REFRESH_RETRY, TOKEN_SAVE_DELAY)
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def _expires(data: Optional[Dict[str, Any]]) -> Optional[float]:
+    """Return wall clock time an access token expires, if known.
+
+    nibeuplink stores the expiry as an iso formatted local time.
+    """
+    if not data:
+        return None
+    value = data.get('access_token_expires')
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        expires = dt_util.parse_datetime(value)
+        if expires is not None:
+            # naive datetimes are taken as local time, as written
+            return expires.timestamp()
+    return None
+
+
+class NibeTokenManager(object):
+    """Keep the access token of an uplink client valid.
+
+    Tokens are refreshed in background ahead of their expiry. The
+    refresh nibeuplink makes on failed authentication is routed here,
+    so concurrent requests failing share a single refresh.
+
+    Access data holding a new refresh token is saved to the config entry
+    right away, as the old one no longer works. Changes of the access
+    token alone are saved after a delay or at shutdown, since losing
+    them only costs another refresh.
+    """
+
+    def __init__(self, hass, entry):
+        """Init."""
+        self._hass = hass
+        self._entry = entry
+        self._uplink = None
+        self._uplink_refresh = None
+        self._access_data = entry.data.get(CONF_ACCESS_DATA)
+        self._refreshing = None  # type: Optional[asyncio.Future]
+        self._refresh_handle = None
+        self._save_handle = None
+        self._unsub_stop = None
+
+    @callback
+    def access_data_write(self, data: Dict[str, Any]):
+        """Receive access data refreshed by the uplink client."""
+        self._access_data = data
+        self._schedule_refresh()
+
+        saved = self._entry.data.get(CONF_ACCESS_DATA) or {}
+        if data.get('refresh_token') != saved.get('refresh_token'):
+            self.async_save()
+            return
+
+        if self._save_handle:
+            self._save_handle.cancel()
+        self._save_handle = self._hass.loop.call_later(
+            TOKEN_SAVE_DELAY, self.async_save)
+
+    @callback
+    def async_save(self, event=None):
+        """Save pending access data to the config entry."""
+        if self._save_handle:
+            self._save_handle.cancel()
+            self._save_handle = None
+        if self._access_data == self._entry.data.get(CONF_ACCESS_DATA):
+            return
+        _LOGGER.debug("Saving access data")
+        self._hass.config_entries.async_update_entry(
+            self._entry, data={
+                **self._entry.data, CONF_ACCESS_DATA: self._access_data
+            })
+
+    @callback
+    def async_start(self, uplink):
+        """Start refreshing tokens of a nibeuplink client."""
+        self._uplink = uplink
+        self._uplink_refresh = uplink.refresh_access_token
+        uplink.refresh_access_token = self.async_refresh
+        self._unsub_stop = self._hass.bus.async_listen_once(
+            EVENT_HOMEASSISTANT_STOP, self.async_save)
+        self._schedule_refresh()
+
+    @callback
+    def async_stop(self):
+        """Stop refreshing tokens, saving pending access data."""
+        if self._refresh_handle:
+            self._refresh_handle.cancel()
+            self._refresh_handle = None
+        if self._unsub_stop:
+            self._unsub_stop()
+            self._unsub_stop = None
+        if self._uplink_refresh:
+            self._uplink.refresh_access_token = self._uplink_refresh
+            self._uplink_refresh = None
+        self.async_save()
+
+    def _schedule_refresh(self, delay: float = None):
+        if self._uplink is None:
+            return
+        if self._refresh_handle:
+            self._refresh_handle.cancel()
+
+        if delay is None:
+            expires = _expires(self._access_data)
+            if expires is None:
+                delay = 0
+            else:
+                delay = max(expires - time.time() - TOKEN_REFRESH_MARGIN, 0)
+
+        _LOGGER.debug("Refreshing access token in %.0fs", delay)
+        self._refresh_handle = self._hass.loop.call_later(
+            delay, self._refresh_due)
+
+    @callback
+    def _refresh_due(self):
+        self._refresh_handle = None
+        self._hass.async_create_task(self._async_refresh_due())
+
+    async def _async_refresh_due(self):
+        try:
+            await self.async_refresh()
+        except Exception as exception:
+            _LOGGER.warning("Error refreshing access token: %s", exception)
+            self._schedule_refresh(TOKEN_REFRESH_RETRY)
+
+    async def async_refresh(self):
+        """Refresh the access token, or join the refresh running."""
+        if self._refreshing is None:
+            self._refreshing = asyncio.ensure_future(
+                self._uplink_refresh())
+
+            def done(future):
+                self._refreshing = None
+                if not future.cancelled():
+                    # mark exception retrieved, callers get it by await
+                    future.exception()
+
+            self._refreshing.add_done_callback(done)
+        else:
+            _LOGGER.debug("Joining access token refresh in flight")
+
+        await asyncio.shield(self._refreshing)
@@ -0,0 +1,208 @@
+"""In-process fake of the nibe uplink api for benchmarks."""
+
+import asyncio
+import random
+import time
+from collections import Counter
+
+from aiohttp import web
+
+PARAMETERS_PER_CATEGORY = 20
+
+
+class FakeUplink(object):
+    """Serve systems, categories, statuses, notifications and parameters.
+
+    Every system has the given number of parameters spread over
+    categories of the master unit. Values drift randomly at the given
+    rate, so adaptive polling sees a realistic mix of changing and
+    constant parameters. Each request is delayed by the given latency,
+    and fails with the given probability.
+    """
+
+    def __init__(self,
+                 systems: int,
+                 parameters: int,
+                 latency: float = 0.0,
+                 error_rate: float = 0.0,
+                 change_rate: float = 0.1,
+                 seed: int = 0):
+        """Init."""
+        self.latency = latency
+        self.error_rate = error_rate
+        self.change_rate = change_rate
+        self.requests = Counter()
+        self.errors = 0
+        self._random = random.Random(seed)
+        self._values = {
+            system_id: {
+                str(40000 + index): self._random.randint(0, 500)
+                for index in range(parameters)
+            }
+            for system_id in range(1, systems + 1)
+        }
+        self._runner = None
+        self.url = None
+
+    @property
+    def total(self) -> int:
+        """Return number of requests served."""
+        return sum(self.requests.values())
+
+    def drift(self):
+        """Change some of the parameter values."""
+        for values in self._values.values():
+            for key in values:
+                if self._random.random() < self.change_rate:
+                    values[key] += self._random.choice((-1, 1))
+
+    def _parameter(self, system_id, key):
+        raw = self._values[system_id].get(key)
+        if raw is None:
+            return None
+        return {
+            'parameterId': int(key),
+            'name': key,
+            'title': 'parameter {}'.format(key),
+            'designation': key,
+            'unit': '°C',
+            'displayValue': '{}°C'.format(raw / 10),
+            'rawValue': raw,
+        }
+
+    def _system(self, system_id):
+        return {
+            'systemId': system_id,
+            'name': 'System {}'.format(system_id),
+            'productName': 'F1255',
+            'securityLevel': 'ADMIN',
+            'serialNumber': str(system_id),
+            'lastActivityDate': time.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'connectionStatus': 'ONLINE',
+            'address': None,
+            'hasAlarmed': False,
+        }
+
+    @web.middleware
+    async def _middleware(self, request, handler):
+        self.requests[request.match_info.route.name or 'unknown'] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self._random.random() < self.error_rate:
+            self.errors += 1
+            raise web.HTTPInternalServerError()
+        return await handler(request)
+
+    async def _token(self, request):
+        return web.json_response({
+            'access_token': 'access',
+            'refresh_token': 'refresh',
+            'expires_in': 1800,
+            'scope': 'READSYSTEM WRITESYSTEM',
+            'token_type': 'bearer',
+        })
+
+    async def _systems(self, request):
+        return web.json_response({
+            'page': 1,
+            'itemsPerPage': 30,
+            'numItems': len(self._values),
+            'objects': [
+                self._system(system_id) for system_id in self._values
+            ],
+        })
+
+    async def _get_system(self, request):
+        return web.json_response(
+            self._system(int(request.match_info['system'])))
+
+    async def _status(self, request):
+        return web.json_response([])
+
+    async def _unit_status(self, request):
+        return web.json_response([])
+
+    async def _notifications(self, request):
+        return web.json_response({
+            'page': 1,
+            'itemsPerPage': 30,
+            'numItems': 0,
+            'objects': [],
+        })
+
+    async def _categories(self, request):
+        system_id = int(request.match_info['system'])
+        keys = list(self._values[system_id].keys())
+        return web.json_response([
+            {
+                'categoryId': 'CATEGORY_{}'.format(index),
+                'name': 'category {}'.format(index),
+                'parameters': [
+                    self._parameter(system_id, key)
+                    for key in keys[index:index + PARAMETERS_PER_CATEGORY]
+                ],
+            }
+            for index in range(0, len(keys), PARAMETERS_PER_CATEGORY)
+        ])
+
+    async def _get_parameters(self, request):
+        system_id = int(request.match_info['system'])
+        result = []
+        for key in request.query.getall('parameterIds', []):
+            parameter = self._parameter(system_id, key)
+            if parameter is not None:
+                result.append(parameter)
+        return web.json_response(result)
+
+    async def _put_parameters(self, request):
+        system_id = int(request.match_info['system'])
+        data = await request.json()
+        result = []
+        for key, value in data.get('settings', {}).items():
+            if key in self._values[system_id]:
+                self._values[system_id][key] = int(float(value) * 10)
+                status = 'DONE'
+            else:
+                status = 'ERROR'
+            result.append({
+                'status': status,
+                'parameter': self._parameter(system_id, key),
+            })
+        return web.json_response(result)
+
+    async def _thermostats(self, request):
+        return web.Response(status=204)
+
+    async def start(self):
+        """Start serving on a free local port."""
+        app = web.Application(middlewares=[self._middleware])
+        api = '/api/v1/systems'
+        app.router.add_post('/oauth/token', self._token, name='token')
+        app.router.add_get(api, self._systems, name='systems')
+        app.router.add_get(api + '/{system}', self._get_system,
+                           name='system')
+        app.router.add_get(api + '/{system}/status/system', self._status,
+                           name='status')
+        app.router.add_get(api + '/{system}/status/systemUnit/{unit}',
+                           self._unit_status, name='unit_status')
+        app.router.add_get(api + '/{system}/notifications',
+                           self._notifications, name='notifications')
+        app.router.add_get(api + '/{system}/serviceinfo/categories',
+                           self._categories, name='categories')
+        app.router.add_get(api + '/{system}/parameters',
+                           self._get_parameters, name='get_parameters')
+        app.router.add_put(api + '/{system}/parameters',
+                           self._put_parameters, name='put_parameters')
+        app.router.add_post(api + '/{system}/smarthome/thermostats',
+                            self._thermostats, name='thermostats')
+
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = 'http://127.0.0.1:{}'.format(port)
+
+    async def stop(self):
+        """Stop serving."""
+        await self._runner.cleanup()
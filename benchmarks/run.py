@@ -0,0 +1,252 @@
+"""Benchmark the nibe integration against a fake uplink server.
+
+Sets up the integration for a number of systems with a number of sensors
+each, then runs update cycles with a simulated clock advancing one scan
+interval per cycle. Errors logged by the integration and entities left
+unavailable are reported, and make the run exit non-zero, so numbers of
+a run that failed are not mistaken for a good one. Needs home assistant
+and nibeuplink installed:
+
+    python benchmarks/run.py --systems 4 --parameters 200 --cycles 30
+"""
+
+import argparse
+import asyncio
+import importlib
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from homeassistant import config_entries
+from homeassistant.const import STATE_UNAVAILABLE
+from homeassistant.core import HomeAssistant
+from homeassistant.setup import async_setup_component
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_uplink import FakeUplink  # noqa
+
+COMPONENT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Clock(object):
+    """Stand in for the time module, running ahead when advanced."""
+
+    def __init__(self):
+        """Init."""
+        self._offset = 0.0
+
+    def advance(self, seconds: float):
+        """Move the clock forward."""
+        self._offset += seconds
+
+    def monotonic(self) -> float:
+        """Return monotonic time."""
+        return time.monotonic() + self._offset
+
+    def time(self) -> float:
+        """Return wall clock time."""
+        return time.time() + self._offset
+
+
+class ErrorCounter(logging.Handler):
+    """Count errors and timeouts logged by the integration."""
+
+    def __init__(self):
+        """Init."""
+        super().__init__(logging.WARNING)
+        self.count = 0
+
+    def emit(self, record):
+        """Count errors, and warnings reporting a timeout."""
+        if (record.levelno >= logging.ERROR or
+                record.getMessage().startswith('Timeout')):
+            self.count += 1
+
+
+def percentile(values, fraction):
+    """Return a percentile of values by nearest rank."""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1,
+                       int(round(fraction * len(ordered))) - 1))
+    return ordered[index]
+
+
+async def run(args):
+    """Run the benchmark, returning its results."""
+    server = FakeUplink(args.systems,
+                        args.parameters,
+                        latency=args.latency,
+                        error_rate=args.error_rate,
+                        change_rate=args.change_rate)
+    await server.start()
+
+    config_dir = tempfile.mkdtemp()
+    os.mkdir(os.path.join(config_dir, 'custom_components'))
+    os.symlink(COMPONENT,
+               os.path.join(config_dir, 'custom_components', 'nibe'))
+    sys.path.insert(0, config_dir)
+
+    hass = HomeAssistant()
+    hass.config.config_dir = config_dir
+    hass.config_entries = config_entries.ConfigEntries(hass, {})
+    await hass.config_entries.async_initialize()
+    await async_setup_component(hass, 'group', {})
+    await async_setup_component(hass, 'persistent_notification', {})
+
+    nibe = importlib.import_module('custom_components.nibe')
+    const = importlib.import_module('custom_components.nibe.const')
+
+    # polling, rate limiting and thermostat keepalive follow the clock,
+    # request latency and token expiry keep to real time
+    clock = Clock()
+    for name in ('custom_components.nibe',
+                 'custom_components.nibe.cache',
+                 'custom_components.nibe.entity',
+                 'custom_components.nibe.limiter',
+                 'custom_components.nibe.thermostat'):
+        importlib.import_module(name).time = clock
+
+    async_use_session = nibe.async_use_session
+
+    async def use_session(hass, uplink, client_id, client_secret):
+        uplink.base = server.url
+        # drop the fixed delay nibeuplink keeps between requests
+        if args.no_throttle:
+            uplink.THROTTLE = timedelta(0)
+        await async_use_session(hass, uplink, client_id, client_secret)
+
+    nibe.async_use_session = use_session
+    if args.no_rate_limit:
+        client = importlib.import_module('custom_components.nibe.client')
+        client.RATE_LIMIT = 60 * 1000
+        client.RATE_LIMIT_BURST = 1000
+
+    config = nibe.CONFIG_SCHEMA({
+        'nibe': {
+            'systems': [
+                {
+                    'system': system_id,
+                    'units': [{'unit': 0, 'categories': True}],
+                    'climates': True,
+                    'water_heaters': True,
+                }
+                for system_id in range(1, args.systems + 1)
+            ]
+        }
+    })
+    await nibe.async_setup(hass, config)
+
+    entry = config_entries.ConfigEntry(
+        version=1,
+        domain='nibe',
+        title='benchmark',
+        data={
+            'client_id': 'client',
+            'client_secret': 'secret',
+            'redirect_uri': 'http://localhost',
+            'writeaccess': True,
+            # shaped the way nibeuplink writes it
+            'access_data': {
+                'access_token': 'access',
+                'refresh_token': 'refresh',
+                'expires_in': 3600,
+                'scope': 'READSYSTEM WRITESYSTEM',
+                'token_type': 'bearer',
+                'access_token_expires': (
+                    datetime.now() + timedelta(hours=1)).isoformat(),
+            },
+        },
+        source=config_entries.SOURCE_USER,
+        connection_class=config_entries.CONN_CLASS_CLOUD_POLL)
+    hass.config_entries._entries.append(entry)
+
+    # the integration logs and swallows failures, so count them instead
+    errors = ErrorCounter()
+    logging.getLogger('custom_components.nibe').addHandler(errors)
+
+    started = time.perf_counter()
+    await nibe.async_setup_entry(hass, entry)
+    await hass.async_block_till_done()
+    setup_time = time.perf_counter() - started
+    setup_requests = server.total
+    setup_errors = errors.count
+
+    systems = list(hass.data[const.DATA_NIBE]['systems'].values())
+    latencies = []
+    requests = []
+    cpu = []
+    for _ in range(args.cycles):
+        server.drift()
+        clock.advance(const.SCAN_INTERVAL)
+
+        total = server.total
+        process = time.process_time()
+        started = time.perf_counter()
+        await asyncio.gather(*[system.update() for system in systems])
+        await hass.async_block_till_done()
+        latencies.append(time.perf_counter() - started)
+        cpu.append(time.process_time() - process)
+        requests.append(server.total - total)
+
+    results = {
+        'systems': args.systems,
+        'parameters': args.parameters,
+        'entities': len(hass.states.async_entity_ids()),
+        'setup_time': setup_time,
+        'setup_requests': setup_requests,
+        'requests_per_cycle': sum(requests) / len(requests),
+        'refresh_p50': percentile(latencies, 0.5),
+        'refresh_p99': percentile(latencies, 0.99),
+        'cpu_per_cycle': sum(cpu) / len(cpu),
+        'errors_injected': server.errors,
+        'setup_errors': setup_errors,
+        'update_errors': errors.count - setup_errors,
+        'unavailable_entities': sorted(
+            state.entity_id for state in hass.states.async_all()
+            if state.state == STATE_UNAVAILABLE),
+        'requests': dict(server.requests),
+    }
+
+    logging.getLogger('custom_components.nibe').removeHandler(errors)
+    await nibe.async_unload_entry(hass, entry)
+    await hass.async_stop()
+    await server.stop()
+    return results
+
+
+def main():
+    """Parse arguments and print results, failing if anything failed."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--systems', type=int, default=1)
+    parser.add_argument('--parameters', type=int, default=100,
+                        help="sensors per system")
+    parser.add_argument('--cycles', type=int, default=20,
+                        help="update cycles to measure")
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help="seconds added to each request")
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help="fraction of requests failing")
+    parser.add_argument('--change-rate', type=float, default=0.1,
+                        help="fraction of values changing per cycle")
+    parser.add_argument('--no-throttle', action='store_true',
+                        help="drop the delay nibeuplink keeps between "
+                             "requests")
+    parser.add_argument('--no-rate-limit', action='store_true',
+                        help="lift the request rate limit")
+    parser.add_argument('--debug', action='store_true')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.WARNING)
+    results = asyncio.get_event_loop().run_until_complete(run(args))
+    print(json.dumps(results, indent=2, sort_keys=True))
+    if (results['setup_errors'] or results['update_errors'] or
+            results['unavailable_entities']):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -34,7 +34,7 @@ async def async_setup_entry(hass, entry, async_add_entities):
                 )
             )
 
-    async_add_entities(entities, True)
+    async_add_entities(entities, False)
 
 
 class NibeBinarySensor(NibeParameterEntity, BinarySensorDevice):
@@ -50,15 +50,13 @@ class NibeBinarySensor(NibeParameterEntity, BinarySensorDevice):
             uplink,
             system_id,
             parameter_id,
-            None,
-            [],
             ENTITY_ID_FORMAT)
 
     @property
     def is_on(self):
         """Return if sensor is on."""
-        data = self._parameters[self._parameter_id]
+        data = self.get_data(self._parameter_id)
         if data:
-            return data['rawValue'] == "1"
+            return data.raw_value == "1"
         else:
             return None
@@ -0,0 +1,324 @@
+"""Parameter cache for nibe uplink."""
+
+import logging
+import re
+import sys
+import time
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple  # noqa
+
+from .const import SCAN_INTERVAL
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def _intern(value):
+    if isinstance(value, str):
+        return sys.intern(value)
+    return value
+
+
+def _ratio(data: Dict[str, Any]) -> Optional[float]:
+    """Return factor from value to raw value of uplink data, if known."""
+    try:
+        if float(data.get('value')):
+            return float(data.get('rawValue')) / float(data.get('value'))
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+def _decimals(data: Dict[str, Any]) -> Optional[float]:
+    """Return factor implied by the decimals of the display value.
+
+    Values displayed as text, like off, are raw values themselves.
+    """
+    display = data.get('displayValue')
+    if display is None:
+        return None
+    match = re.search(r'\d+(?:\.(\d+))?', str(display))
+    if match is None:
+        return 1.0
+    return 10.0 ** len(match.group(1) or '')
+
+
+class ParameterMeta(object):
+    """Descriptive fields of a parameter, shared by all its records.
+
+    The scale converts values to raw values. It is taken from a received
+    value and raw value, or guessed from the decimals shown while the
+    value is zero.
+    """
+
+    __slots__ = ('parameter_id', 'name', 'title', 'designation', 'unit',
+                 'scale')
+
+    def __init__(self, parameter_id, name, title, designation, unit,
+                 scale=None):
+        """Init."""
+        self.parameter_id = parameter_id
+        self.name = name
+        self.title = title
+        self.designation = designation
+        self.unit = unit
+        self.scale = scale
+
+    @staticmethod
+    def from_data(data: Dict[str, Any]) -> 'ParameterMeta':
+        """Create metadata from uplink data."""
+        meta = ParameterMeta(*[_intern(x) for x in ParameterMeta._key(data)])
+        meta.learn(data)
+        return meta
+
+    def learn(self, data: Dict[str, Any]):
+        """Take the scale from uplink data if it tells."""
+        ratio = _ratio(data)
+        if ratio is not None:
+            self.scale = ratio
+        elif self.scale is None:
+            self.scale = _decimals(data)
+
+    @staticmethod
+    def _key(data: Dict[str, Any]) -> Tuple:
+        return (data.get('parameterId'),
+                data.get('name'),
+                data.get('title'),
+                data.get('designation'),
+                data.get('unit'))
+
+    def matches(self, data: Dict[str, Any]) -> bool:
+        """Return if uplink data describes the parameter the same way."""
+        return ParameterMeta._key(data) == (self.parameter_id,
+                                            self.name,
+                                            self.title,
+                                            self.designation,
+                                            self.unit)
+
+
+class ParameterRecord(object):
+    """Last received value of a parameter."""
+
+    __slots__ = ('meta', 'raw_value', 'value', 'display_value')
+
+    def __init__(self, meta: ParameterMeta, raw_value, value, display_value):
+        """Init."""
+        self.meta = meta
+        self.raw_value = raw_value
+        self.value = value
+        self.display_value = display_value
+
+    @staticmethod
+    def from_data(data: Dict[str, Any],
+                  meta: ParameterMeta = None) -> 'ParameterRecord':
+        """Create a record from uplink data, sharing metadata if given."""
+        return ParameterRecord(meta or ParameterMeta.from_data(data),
+                               data.get('rawValue'),
+                               data.get('value'),
+                               data.get('displayValue'))
+
+    def differs(self, data: Dict[str, Any]) -> bool:
+        """Return if uplink data holds another value than this record."""
+        return (self.raw_value != data.get('rawValue') or
+                self.display_value != data.get('displayValue'))
+
+    def written(self, value) -> 'ParameterRecord':
+        """Return a copy of this record with a written value applied.
+
+        Parameters never received are taken to be unscaled.
+        """
+        try:
+            number = float(value)
+        except (TypeError, ValueError):
+            number = raw_value = value
+        else:
+            scale = self.meta.scale
+            if scale is None:
+                scale = 1.0
+            raw_value = int(round(number * scale))
+        return ParameterRecord(self.meta,
+                               raw_value,
+                               number,
+                               '{}{}'.format(value, self.unit or ''))
+
+    @property
+    def parameter_id(self):
+        """Return parameter identifier."""
+        return self.meta.parameter_id
+
+    @property
+    def title(self):
+        """Return parameter title."""
+        return self.meta.title
+
+    @property
+    def designation(self):
+        """Return parameter designation."""
+        return self.meta.designation
+
+    @property
+    def unit(self):
+        """Return parameter unit."""
+        return self.meta.unit
+
+
+class NibeParameterCache(object):
+    """Authoritative store of the parameter values of one system.
+
+    Fetch times are taken from the monotonic clock, so freshness is not
+    affected by changes of the wall clock. Metadata is kept once per
+    parameter and shared by the records replacing each other.
+    """
+
+    def __init__(self,
+                 system_id: int,
+                 ttl: float = SCAN_INTERVAL * 2):
+        """Init with time to live in seconds."""
+        self.system_id = system_id
+        self._ttl = ttl
+        self._data = {}  # type: Dict[str, Optional[ParameterRecord]]
+        self._fetched = {}  # type: Dict[str, float]
+        self._metas = {}  # type: Dict[str, ParameterMeta]
+        self._restored = set()  # type: Set[str]
+
+    def __contains__(self, parameter_id):
+        """Return if a parameter has ever been received."""
+        return str(parameter_id) in self._fetched
+
+    def get(self, parameter_id) -> Optional[ParameterRecord]:
+        """Return last known data of a parameter."""
+        return self._data.get(str(parameter_id))
+
+    def differs(self,
+                parameter_id,
+                data: Optional[Dict[str, Any]]) -> bool:
+        """Return if uplink data holds another value than the cache."""
+        record = self.get(parameter_id)
+        if record is None or data is None:
+            return record is not data
+        return record.differs(data)
+
+    def fetched(self, parameter_id) -> Optional[float]:
+        """Return monotonic time a parameter was last received."""
+        return self._fetched.get(str(parameter_id))
+
+    def restored(self, parameter_id) -> bool:
+        """Return if a parameter only has a value from a snapshot."""
+        return str(parameter_id) in self._restored
+
+    def is_fresh(self, parameter_id, now: float = None) -> bool:
+        """Return if the data of a parameter is still within its ttl."""
+        fetched = self.fetched(parameter_id)
+        if fetched is None:
+            return False
+        if now is None:
+            now = time.monotonic()
+        return now < fetched + self._ttl
+
+    def stale(self, parameter_ids: Iterable, now: float = None) -> List:
+        """Return the parameters that are missing or outdated."""
+        if now is None:
+            now = time.monotonic()
+        return [
+            parameter_id
+            for parameter_id in parameter_ids
+            if not self.is_fresh(parameter_id, now)
+        ]
+
+    def _meta(self, key: str, data: Dict[str, Any]) -> ParameterMeta:
+        meta = self._metas.get(key)
+        if meta is None or not meta.matches(data):
+            meta = ParameterMeta.from_data(data)
+            self._metas[key] = meta
+        else:
+            meta.learn(data)
+        return meta
+
+    def seed(self, parameters: Iterable[Dict[str, Any]]):
+        """Make metadata of parameters known before any value is received."""
+        for data in parameters:
+            key = str(data['parameterId'])
+            if self._data.get(key) is None:
+                self._data[key] = ParameterRecord(
+                    self._meta(key, data), None, None, None)
+
+    def replace(self,
+                parameter_id,
+                record: Optional[ParameterRecord]
+                ) -> Optional[ParameterRecord]:
+        """Replace data of a parameter, without counting it as received."""
+        key = str(parameter_id)
+        previous = self._data.get(key)
+        self._data[key] = record
+        return previous
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """Return received values with wall clock fetch times for storage."""
+        now = time.monotonic()
+        wall = time.time()
+        result = {}
+        for key, fetched in self._fetched.items():
+            record = self._data.get(key)
+            if record is None:
+                continue
+            meta = record.meta
+            result[key] = {
+                'parameterId': meta.parameter_id,
+                'name': meta.name,
+                'title': meta.title,
+                'designation': meta.designation,
+                'unit': meta.unit,
+                'rawValue': record.raw_value,
+                'value': record.value,
+                'displayValue': record.display_value,
+                'fetched': wall - (now - fetched),
+            }
+        return result
+
+    def restore(self, snapshot: Optional[Dict[str, Dict[str, Any]]]):
+        """Restore values from a snapshot, all marked as stale."""
+        if not snapshot:
+            return
+        now = time.monotonic()
+        wall = time.time()
+        for key, data in snapshot.items():
+            if key in self._fetched:
+                continue
+            fetched = now - max(wall - data.get('fetched', 0), 0)
+            self._data[key] = ParameterRecord.from_data(
+                data, self._meta(key, data))
+            self._fetched[key] = min(fetched, now - self._ttl)
+            self._restored.add(key)
+
+    def touch(self, parameter_ids: Iterable, now: float = None):
+        """Mark parameters as received again without any change."""
+        if now is None:
+            now = time.monotonic()
+        for parameter_id in parameter_ids:
+            key = str(parameter_id)
+            if key in self._fetched:
+                self._fetched[key] = now
+                self._restored.discard(key)
+
+    def update(self,
+               parameters: Dict[Any, Optional[Dict[str, Any]]],
+               now: float = None) -> Set[str]:
+        """Store received parameters and return their keys."""
+        if now is None:
+            now = time.monotonic()
+        keys = set()
+        for parameter_id, data in parameters.items():
+            key = str(parameter_id)
+            record = self._data.get(key)
+            if data is None:
+                self._data[key] = None
+            else:
+                meta = self._meta(key, data)
+                if record is None or record.meta is not meta:
+                    self._data[key] = ParameterRecord.from_data(data, meta)
+                else:
+                    record.raw_value = data.get('rawValue')
+                    record.value = data.get('value')
+                    record.display_value = data.get('displayValue')
+            self._fetched[key] = now
+            self._restored.discard(key)
+            keys.add(key)
+        return keys
@@ -0,0 +1,192 @@
+"""Uplink client wrapper for nibe uplink."""
+
+import asyncio
+import logging
+from typing import Dict, Hashable  # noqa
+
+import aiohttp
+
+from .const import (PRIORITY_HIGH, PRIORITY_LOW, PRIORITY_NORMAL, RATE_LIMIT,
+                    RATE_LIMIT_BURST, RATE_LIMIT_RETRIES, RETRY_AFTER_DEFAULT)
+from .limiter import NibeLimiter, parse_retry_after
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def _params_key(params) -> Hashable:
+    """Return a hashable form of request parameters."""
+    if isinstance(params, dict):
+        return tuple(sorted(params.items()))
+    return tuple(params)
+
+
+class NibeClient(object):
+    """Wrap an uplink client to coordinate all requests made to it.
+
+    Concurrent identical reads share a single call, and every call waits
+    for a slot from a rate limiter according to its priority.
+    """
+
+    def __init__(self, uplink, limiter: NibeLimiter = None):
+        """Init."""
+        self._uplink = uplink
+        self._limiter = limiter or NibeLimiter(RATE_LIMIT / 60,
+                                               RATE_LIMIT_BURST)
+        self._inflight = {}  # type: Dict[Hashable, asyncio.Future]
+
+    def __getattr__(self, name):
+        """Forward anything not wrapped to the uplink client."""
+        return getattr(self._uplink, name)
+
+    @property
+    def inflight(self) -> int:
+        """Return number of reads currently in flight."""
+        return len(self._inflight)
+
+    @property
+    def queue_depth(self) -> int:
+        """Return number of requests waiting on the rate limiter."""
+        return self._limiter.queue_depth
+
+    async def _call(self, priority: int, fun, *args, **kwargs):
+        """Run a call once the rate limiter allows it."""
+        retries = 0
+        while True:
+            await self._limiter.acquire(priority)
+            try:
+                return await fun(*args, **kwargs)
+            except aiohttp.ClientResponseError as exception:
+                if exception.status != 429 or retries >= RATE_LIMIT_RETRIES:
+                    raise
+                retries += 1
+                headers = exception.headers or {}
+                delay = parse_retry_after(headers.get('Retry-After'))
+                if delay is None:
+                    delay = RETRY_AFTER_DEFAULT
+                self._limiter.backoff(delay)
+
+    async def _single_flight(self, key: Hashable, priority: int,
+                             fun, *args, **kwargs):
+        """Run a call, or join the identical call already running.
+
+        Only calls of the same priority are joined, so an urgent read
+        never waits behind a background one queued on the rate limiter.
+        """
+        key = (priority, *key)
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(
+                self._call(priority, fun, *args, **kwargs))
+            self._inflight[key] = future
+
+            def done(future):
+                self._inflight.pop(key, None)
+                if not future.cancelled():
+                    # mark exception retrieved, callers get it by await
+                    future.exception()
+
+            future.add_done_callback(done)
+        else:
+            _LOGGER.debug("Joining request in flight %s", key)
+
+        return await asyncio.shield(future)
+
+    async def get(self, url: str, params={}, priority=PRIORITY_NORMAL):
+        """Get a raw api url."""
+        return await self._single_flight(
+            ('get', url, _params_key(params)), priority,
+            self._uplink.get, url, params)
+
+    async def get_parameters(self, system_id: int, parameter_ids,
+                             priority=PRIORITY_NORMAL, fresh=False):
+        """Get parameters, sent by nibeuplink as a single request.
+
+        Fresh reads never join a call already in flight.
+        """
+        keys = tuple(str(x) for x in parameter_ids)
+        if fresh:
+            return await self._call(
+                priority, self._get_parameters, system_id, keys)
+        return await self._single_flight(
+            ('get_parameters', system_id, keys), priority,
+            self._get_parameters, system_id, keys)
+
+    async def _get_parameters(self, system_id: int, parameter_ids):
+        """Get parameters concurrently, for nibeuplink to batch them."""
+        results = await asyncio.gather(*[
+            self._uplink.get_parameter(system_id, parameter_id)
+            for parameter_id in parameter_ids
+        ])
+        return dict(zip(parameter_ids, results))
+
+    async def get_system(self, system_id: int):
+        """Get a system."""
+        return await self._single_flight(
+            ('get_system', system_id), PRIORITY_NORMAL,
+            self._uplink.get_system, system_id)
+
+    async def get_systems(self):
+        """Get all systems."""
+        return await self._single_flight(
+            ('get_systems',), PRIORITY_NORMAL,
+            self._uplink.get_systems)
+
+    async def get_status(self, system_id: int):
+        """Get status of a system."""
+        return await self._single_flight(
+            ('get_status', system_id), PRIORITY_NORMAL,
+            self._uplink.get_status, system_id)
+
+    async def get_unit_status(self, system_id: int, unit_id: int):
+        """Get status of a unit."""
+        return await self._single_flight(
+            ('get_unit_status', system_id, unit_id), PRIORITY_LOW,
+            self._uplink.get_unit_status, system_id, unit_id)
+
+    async def get_categories(self,
+                             system_id: int,
+                             parameters: bool,
+                             unit_id: int = 0):
+        """Get categories of a unit."""
+        return await self._single_flight(
+            ('get_categories', system_id, parameters, unit_id), PRIORITY_LOW,
+            self._uplink.get_categories, system_id, parameters, unit_id)
+
+    async def get_notifications(self, system_id: int):
+        """Get active alarms of a system."""
+        return await self._single_flight(
+            ('get_notifications', system_id), PRIORITY_NORMAL,
+            self._uplink.get_notifications, system_id)
+
+    async def put_parameters(self, system_id: int, settings: Dict[str, str]):
+        """Set parameters in a single request, returning their statuses."""
+        return await self._call(
+            PRIORITY_HIGH,
+            self._put_parameters, system_id, settings)
+
+    async def _put_parameters(self, system_id: int, settings):
+        """Put a map of settings, as nibeuplink does for a single one."""
+        data = await self._uplink.put(
+            'systems/{}/parameters'.format(system_id),
+            json={'settings': settings},
+            headers={
+                'Accept': 'application/json',
+                'Content-Type': 'application/json;charset=UTF-8'
+            })
+        # uplink answers in the order the settings were given
+        return {
+            key: result['status']
+            for key, result in zip(settings.keys(), data)
+        }
+
+    async def put_smarthome_mode(self, system_id: int, mode: str):
+        """Set smarthome mode."""
+        return await self._call(
+            PRIORITY_HIGH,
+            self._uplink.put_smarthome_mode, system_id, mode)
+
+    async def post_smarthome_thermostats(self, system_id: int, thermostat):
+        """Publish a smarthome thermostat."""
+        return await self._call(
+            PRIORITY_HIGH,
+            self._uplink.post_smarthome_thermostats, system_id, thermostat)
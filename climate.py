@@ -1,9 +1,7 @@
 """Climate entities for nibe uplink."""
 
-import asyncio
 import logging
 from collections import OrderedDict
-from datetime import timedelta
 from typing import List, Set
 
 from homeassistant.components.climate import ENTITY_ID_FORMAT, ClimateDevice
@@ -16,18 +14,20 @@ from homeassistant.components.climate.const import (ATTR_OPERATION_MODE,
 from homeassistant.const import (ATTR_TEMPERATURE, CONF_NAME, STATE_OFF,
                                  STATE_UNAVAILABLE, STATE_UNKNOWN,
                                  TEMP_CELSIUS)
+from homeassistant.core import callback
 from homeassistant.exceptions import PlatformNotReady
-from homeassistant.helpers.event import (async_track_state_change,
-                                         async_track_time_interval)
+from homeassistant.helpers.event import async_track_state_change
 from homeassistant.helpers.restore_state import RestoreEntity
 
 from . import NibeSystem
-from .const import (ATTR_TARGET_TEMPERATURE, ATTR_VALVE_POSITION,
+from .const import (ATTR_LAST_PUBLISHED, ATTR_TARGET_TEMPERATURE,
+                    ATTR_VALVE_POSITION,
                     CONF_CLIMATE_SYSTEMS, CONF_CLIMATES,
                     CONF_CURRENT_TEMPERATURE, CONF_THERMOSTATS,
                     CONF_VALVE_POSITION, DATA_NIBE,
                     DEFAULT_THERMOSTAT_TEMPERATURE)
 from .const import DOMAIN as DOMAIN_NIBE
+from .discovery import NibeDiscovery
 from .entity import NibeEntity
 
 DEPENDENCIES = ['nibe']
@@ -35,22 +35,21 @@ PARALLEL_UPDATES = 0
 _LOGGER = logging.getLogger(__name__)
 
 
-async def _is_climate_active(uplink, system, climate):
+async def _is_climate_active(system, climate):
     if not system.config[CONF_CLIMATES]:
         return False
 
     if climate.active_accessory is None:
         return True
 
-    active_accessory = await uplink.get_parameter(
-        system.system_id,
-        climate.active_accessory)
+    data = await system.get_parameters([climate.active_accessory])
+    active_accessory = data[climate.active_accessory]
 
     _LOGGER.debug("Accessory status for {} is {}".format(
         climate.name,
         active_accessory))
 
-    if active_accessory and active_accessory['rawValue']:
+    if active_accessory and active_accessory.raw_value:
         return True
 
     return False
@@ -69,27 +68,23 @@ async def async_setup_entry(hass, entry, async_add_entities):
     uplink = hass.data[DATA_NIBE]['uplink']  # type: Uplink
     systems = hass.data[DATA_NIBE]['systems']  # type: List[NibeSystem]
 
-    entities = []
-
-    async def add_active(system: NibeSystem, climate: ClimateSystem):
-        if await _is_climate_active(uplink, system, climate):
-            entities.append(
-                NibeClimateSupply(
-                    uplink,
-                    system.system_id,
-                    system.statuses,
-                    climate
-                )
-            )
-            entities.append(
-                NibeClimateRoom(
-                    uplink,
-                    system.system_id,
-                    system.statuses,
-                    climate
-                )
-            )
+    def create(system: NibeSystem, climate: ClimateSystem):
+        return [
+            NibeClimateSupply(
+                uplink,
+                system.system_id,
+                system.statuses,
+                climate
+            ),
+            NibeClimateRoom(
+                uplink,
+                system.system_id,
+                system.statuses,
+                climate
+            ),
+        ]
 
+    entities = []
     for system in systems.values():
         thermostats = system.config[CONF_THERMOSTATS]
         for thermostat_id, thermostat_config in thermostats.items():
@@ -105,14 +100,17 @@ async def async_setup_entry(hass, entry, async_add_entities):
                 )
             )
 
-    await asyncio.gather(*[
-        add_active(system, climate)
-        for climate in PARAM_CLIMATE_SYSTEMS.values()
-        for system in systems.values()
-    ])
-
     async_add_entities(entities, True)
 
+    discovery = NibeDiscovery(hass,
+                              entry,
+                              CONF_CLIMATES,
+                              PARAM_CLIMATE_SYSTEMS,
+                              _is_climate_active,
+                              create,
+                              async_add_entities)
+    await discovery.async_load(systems.values())
+
 
 class NibeClimate(NibeEntity, ClimateDevice):
     """Base class for nibe climate entities."""
@@ -125,8 +123,7 @@ class NibeClimate(NibeEntity, ClimateDevice):
         """Init."""
         super(NibeClimate, self).__init__(
             uplink,
-            system_id,
-            [])
+            system_id)
 
         from nibeuplink import (PARAM_PUMP_SPEED_HEATING_MEDIUM)
 
@@ -198,32 +195,29 @@ class NibeClimate(NibeEntity, ClimateDevice):
         """Turn the climate off."""
         return
 
-    async def async_set_temperature_internal(self, parameter, data):
+    async def async_set_temperature_internal(self, parameter, data,
+                                             derived=None):
         """Set temperature."""
         _LOGGER.debug("Set temperature on parameter {} to {}".format(
             parameter,
             data))
 
-        try:
-            self._status = await self._uplink.put_parameter(self._system_id,
-                                                            parameter,
-                                                            data)
-        except BaseException:
-            self._status = 'ERROR'
-            raise
-        finally:
+        @callback
+        def written(future):
+            if future.cancelled() or future.exception():
+                self._status = 'ERROR'
+            else:
+                self._status = future.result()
             _LOGGER.debug("Put parameter response {}".format(self._status))
+            self.async_schedule_update_if_changed()
 
-    async def async_update(self):
-        """Update internal state."""
-        _LOGGER.debug("Update climate {}".format(self.name))
-        await super().async_update()
-        self.parse_data()
+        self.system.writer.async_write(
+            parameter, data, derived).add_done_callback(written)
 
     async def async_statuses_updated(self, statuses: Set[str]):
         """Statuses have been updated."""
         self.parse_statuses(statuses)
-        self.async_schedule_update_ha_state()
+        self.async_schedule_update_if_changed()
 
     def parse_statuses(self, statuses: Set[str]):
         """Parse status list."""
@@ -236,10 +230,6 @@ class NibeClimate(NibeEntity, ClimateDevice):
         else:
             self._is_on = False
 
-    def parse_data(self):
-        """Parse data received."""
-        pass
-
 
 class NibeClimateRoom(NibeClimate):
     """Climate entity for a room temperature sensor."""
@@ -280,9 +270,9 @@ class NibeClimateRoom(NibeClimate):
     @property
     def temperature_unit(self):
         """Return temperature unit used."""
-        data = self._parameters[self._climate.room_temp]
+        data = self.get_data(self._climate.room_temp)
         if data:
-            return data['unit']
+            return data.unit
         else:
             return None
 
@@ -393,9 +383,9 @@ class NibeClimateSupply(NibeClimate):
     @property
     def temperature_unit(self):
         """Return used temperature unit."""
-        data = self._parameters[self._climate.supply_temp]
+        data = self.get_data(self._climate.supply_temp)
         if data:
-            return data['unit']
+            return data.unit
         else:
             return None
 
@@ -446,9 +436,11 @@ class NibeClimateSupply(NibeClimate):
             return
         # calculate what offset was used to calculate the target
         base = self.get_target_base()
-        data = data - base
 
-        await self.async_set_temperature_internal(self._adjust_id, data)
+        # the target is calculated from the offset by the pump
+        await self.async_set_temperature_internal(self._adjust_id,
+                                                  data - base,
+                                                  {self._target_id: data})
 
     @property
     def device_state_attributes(self):
@@ -505,7 +497,7 @@ class NibeThermostat(ClimateDevice, RestoreEntity):
         self._systems = systems
         self._target_temperature = DEFAULT_THERMOSTAT_TEMPERATURE
         self._operation_list = [STATE_AUTO, STATE_OFF, STATE_IDLE]
-        self._scheduled_update = None
+        self._unsub = []
 
     async def async_added_to_hass(self):
         """Run whe?n entity about to be added."""
@@ -521,33 +513,47 @@ class NibeThermostat(ClimateDevice, RestoreEntity):
 
         def track_entity_id(tracked_entity_id, update_fun):
             if tracked_entity_id:
-                async def changed(entity_id, old_state, new_state):
+                @callback
+                def changed(entity_id, old_state, new_state):
                     update_fun(new_state)
-                    await self._async_publish()
-                    await self.async_update_ha_state()
+                    self._async_publish_later()
+                    self.async_schedule_update_ha_state()
 
                 update_fun(self.hass.states.get(tracked_entity_id))
 
-                async_track_state_change(
+                self._unsub.append(async_track_state_change(
                     self.hass,
                     tracked_entity_id,
-                    changed)
+                    changed))
 
         track_entity_id(self._current_temperature_id,
                         self._update_current_temperature)
         track_entity_id(self._valve_position_id,
                         self._update_valve_position)
 
-        self._schedule()
+        self._unsub.append(self.publisher.async_add(self))
 
-    def _schedule(self):
-        if self._scheduled_update:
-            self._scheduled_update()
-        self._scheduled_update = async_track_time_interval(
-            self.hass,
-            self._async_publish,
-            timedelta(minutes=15)
-        )
+    async def async_will_remove_from_hass(self):
+        """Stop tracking and publishing."""
+        for unsub in self._unsub:
+            unsub()
+        self._unsub = []
+
+    @property
+    def publisher(self):
+        """Return the thermostat publisher of the system."""
+        return self.hass.data[DATA_NIBE]['systems'][self._system_id].\
+            thermostats
+
+    @property
+    def external_id(self):
+        """Return identifier of thermostat in uplink."""
+        return self._external_id
+
+    @callback
+    def _async_publish_later(self):
+        """Publish once changes have settled for a while."""
+        self.publisher.async_publish_later(self._external_id)
 
     @property
     def unique_id(self):
@@ -584,6 +590,8 @@ class NibeThermostat(ClimateDevice, RestoreEntity):
         data = OrderedDict()
         data[ATTR_VALVE_POSITION] = self._valve_position
         data[ATTR_TARGET_TEMPERATURE] = self._target_temperature
+        data[ATTR_LAST_PUBLISHED] = self.publisher.last_published(
+            self._external_id)
         return data
 
     @property
@@ -681,11 +689,11 @@ class NibeThermostat(ClimateDevice, RestoreEntity):
         await self._async_publish_update()
 
     async def _async_publish_update(self):
-        self._schedule()
-        await self._async_publish()
+        self._async_publish_later()
         await self.async_update_ha_state()
 
-    async def _async_publish(self, time=None):
+    def publish_data(self):
+        """Return payload to compare and data to publish."""
         from nibeuplink import SetThermostatModel
 
         def scaled(value, multi=10):
@@ -719,10 +727,7 @@ class NibeThermostat(ClimateDevice, RestoreEntity):
             climateSystems=systems,
         )
 
-        _LOGGER.debug("Publish thermostat {}".format(data))
-        await self._uplink.post_smarthome_thermostats(
-            self._system_id,
-            data)
+        return (actual, target, valve, tuple(systems)), data
 
     async def async_update(self):
         """Explicitly update thermostat state."""
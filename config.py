@@ -13,6 +13,7 @@ from .const import (AUTH_CALLBACK_NAME, AUTH_CALLBACK_URL, CONF_ACCESS_DATA,
                     CONF_CLIENT_ID, CONF_CLIENT_SECRET, CONF_CODE,
                     CONF_REDIRECT_URI, CONF_UPLINK_APPLICATION_URL,
                     CONF_WRITEACCESS, DATA_NIBE, DOMAIN)
+from .session import async_use_session
 
 _LOGGER = logging.getLogger(__name__)
 _view = None
@@ -47,6 +48,10 @@ class NibeConfigFlow(config_entries.ConfigFlow):
                 redirect_uri=user_input[CONF_REDIRECT_URI],
                 scope=scope
             )
+            await async_use_session(self.hass,
+                                    uplink,
+                                    user_input[CONF_CLIENT_ID],
+                                    user_input[CONF_CLIENT_SECRET])
             self.uplink = uplink
             self.user_data = user_input
             return await self.async_step_auth()
@@ -2,6 +2,7 @@
 
 ATTR_TARGET_TEMPERATURE = 'target_temperature'
 ATTR_VALVE_POSITION = 'valve_position'
+ATTR_LAST_PUBLISHED = 'last_published'
 
 DOMAIN = 'nibe'
 DATA_NIBE = 'nibe'
@@ -27,6 +28,11 @@ CONF_THERMOSTATS = 'thermostats'
 CONF_CURRENT_TEMPERATURE = 'current_temperature'
 CONF_VALVE_POSITION = 'valve_position'
 CONF_CLIMATE_SYSTEMS = 'systems'
+CONF_MAX_INTERVAL = 'max_interval'
+CONF_TOPOLOGY = 'topology'
+CONF_CONNECTION_LIMIT = 'connection_limit'
+CONF_KEEPALIVE_TIMEOUT = 'keepalive_timeout'
+CONF_REQUEST_TIMEOUT = 'request_timeout'
 CONF_CODE = 'code'
 
 AUTH_CALLBACK_URL = '/api/nibe/auth'
@@ -36,10 +42,51 @@ CONF_UPLINK_APPLICATION_URL = 'https://api.nibeuplink.com/Applications'
 
 SERVICE_SET_SMARTHOME_MODE = 'set_smarthome_mode'
 SERVICE_SET_PARAMETER = 'set_parameter'
+SERVICE_APPLY_PARAMETERS = 'apply_parameters'
+SERVICE_DUMP_METRICS = 'dump_metrics'
 
-SIGNAL_PARAMETERS_UPDATED = 'nibe.parameters_updated'
-SIGNAL_STATUSES_UPDATED = 'nibe.statuses_updated'
+EVENT_PARAMETERS_APPLIED = 'nibe_parameters_applied'
+
+SIGNAL_STATUSES_UPDATED = 'nibe.statuses_updated.{}'
 
 SCAN_INTERVAL = 60
+MAX_INTERVAL = 900
+STATE_KEEPALIVE = 900
+UPDATE_TIMEOUT = 60
+SETUP_TIMEOUT = 120
+SETUP_PARALLEL = 4
+
+CONNECTION_LIMIT = 4
+KEEPALIVE_TIMEOUT = 120
+REQUEST_TIMEOUT = 30
+DNS_CACHE_TTL = 300
+
+RATE_LIMIT = 15
+RATE_LIMIT_BURST = 5
+RATE_LIMIT_RETRIES = 2
+RETRY_AFTER_DEFAULT = 60
+
+WRITE_DELAY = 1
+WRITE_PARALLEL = 4
+WRITE_RETRIES = 2
+WRITE_RETRY_DELAY = 5
+WRITE_STATUS_DONE = 'DONE'
+
+TOKEN_REFRESH_MARGIN = 300
+TOKEN_REFRESH_RETRY = 60
+TOKEN_SAVE_DELAY = 600
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+STORAGE_VERSION = 1
+STORAGE_KEY_SCHEDULE = 'nibe.{}.schedule'
+STORAGE_KEY_CATALOGUE = 'nibe.{}.catalogue'
+STORAGE_KEY_SNAPSHOT = 'nibe.{}.snapshot'
+STORAGE_SAVE_DELAY = 60
+SNAPSHOT_INTERVAL = 900
 
 DEFAULT_THERMOSTAT_TEMPERATURE = 22
+THERMOSTAT_DEBOUNCE = 5
+THERMOSTAT_MAX_AGE = 900
@@ -0,0 +1,151 @@
+"""Discovery of active accessories for nibe uplink."""
+
+import asyncio
+import logging
+from typing import Callable, Dict, List, Tuple  # noqa
+
+from homeassistant.helpers.entity import Entity  # noqa
+
+from .const import CONF_TOPOLOGY
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class NibeDiscovery(object):
+    """Create entities for the active accessories of systems.
+
+    Which accessories are active is remembered in the config entry, so
+    later starts create their entities right away and probe uplink again
+    in background, only adding or removing entities if it changed. The
+    kind doubles as the system config option enabling those accessories.
+    """
+
+    def __init__(self,
+                 hass,
+                 entry,
+                 kind: str,
+                 candidates: Dict,
+                 is_active: Callable,
+                 factory: Callable,
+                 async_add_entities):
+        """Init."""
+        self._hass = hass
+        self._entry = entry
+        self._kind = kind
+        self._candidates = {
+            str(key): value for key, value in candidates.items()
+        }
+        self._is_active = is_active
+        self._factory = factory
+        self._async_add_entities = async_add_entities
+        self._entities = {}  # type: Dict[Tuple[int, str], List[Entity]]
+
+    def _stored(self, system) -> List[str]:
+        """Return accessories stored as active for a system."""
+        topology = self._entry.data.get(CONF_TOPOLOGY, {})
+        return topology.get(str(system.system_id), {}).get(self._kind)
+
+    def _store(self, found: Dict[int, List[str]]):
+        """Store active accessories of systems in the config entry."""
+        topology = dict(self._entry.data.get(CONF_TOPOLOGY, {}))
+        for system_id, keys in found.items():
+            topology[str(system_id)] = {
+                **topology.get(str(system_id), {}),
+                self._kind: keys,
+            }
+        self._hass.config_entries.async_update_entry(
+            self._entry, data={
+                **self._entry.data, CONF_TOPOLOGY: topology
+            })
+
+    def _create(self, system, keys) -> List[Entity]:
+        """Create entities of accessories."""
+        entities = []
+        for key in keys:
+            if key not in self._candidates:
+                continue
+            created = self._factory(system, self._candidates[key])
+            self._entities[(system.system_id, key)] = created
+            entities.extend(created)
+        return entities
+
+    async def _async_probe(self, systems) -> Dict[int, List[str]]:
+        """Return active accessories of systems that could be probed."""
+        async def probe(system):
+            results = await asyncio.gather(*[
+                self._is_active(system, candidate)
+                for candidate in self._candidates.values()
+            ])
+            return sorted(
+                key
+                for key, active in zip(self._candidates.keys(), results)
+                if active
+            )
+
+        results = await asyncio.gather(*[
+            probe(system) for system in systems
+        ], return_exceptions=True)
+
+        found = {}
+        for system, result in zip(systems, results):
+            if isinstance(result, Exception):
+                _LOGGER.error("Error probing %s of system %s: %s",
+                              self._kind, system.system_id, result)
+            else:
+                found[system.system_id] = result
+        return found
+
+    async def async_load(self, systems):
+        """Create entities of systems, probing those not known before."""
+        entities = []
+        known = []
+        unknown = []
+        for system in systems:
+            if not system.config[self._kind]:
+                continue
+            keys = self._stored(system)
+            if keys is None:
+                unknown.append(system)
+            else:
+                known.append(system)
+                entities.extend(self._create(system, keys))
+
+        if unknown:
+            found = await self._async_probe(unknown)
+            for system in unknown:
+                entities.extend(self._create(
+                    system, found.get(system.system_id, [])))
+            if found:
+                self._store(found)
+
+        self._async_add_entities(entities, False)
+
+        if known:
+            self._hass.async_create_task(self._async_reconcile(known))
+
+    async def _async_reconcile(self, systems):
+        """Probe systems again, updating entities of changed ones."""
+        found = await self._async_probe(systems)
+        changed = {}
+        entities = []
+        for system in systems:
+            if system.system_id not in found:
+                continue
+            keys = found[system.system_id]
+            stored = self._stored(system)
+            if keys == stored:
+                continue
+
+            _LOGGER.info("Active %s of system %s changed from %s to %s",
+                         self._kind, system.system_id, stored, keys)
+            changed[system.system_id] = keys
+            for key in set(stored) - set(keys):
+                for entity in self._entities.pop((system.system_id, key),
+                                                 []):
+                    await entity.async_remove()
+            entities.extend(self._create(
+                system, [key for key in keys if key not in stored]))
+
+        if changed:
+            self._store(changed)
+            self._async_add_entities(entities, False)
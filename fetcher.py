@@ -0,0 +1,129 @@
+"""Bulk parameter retrieval for nibe uplink."""
+
+import asyncio
+import logging
+from typing import Dict, Iterable  # noqa
+
+from .const import PRIORITY_NORMAL
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class NibeFetcher(object):
+    """Collect parameter requests for a system and retrieve them in bulk.
+
+    Requests are split in chunks of at most MAX_REQUEST_PARAMETERS, each
+    taking one rate limiter slot. Within a chunk the parameters are read
+    concurrently, which nibeuplink sends as a single request.
+    """
+
+    def __init__(self, uplink, system_id):
+        """Init."""
+        self._uplink = uplink
+        self._system_id = system_id
+        self._pending = {}  # type: Dict[str, asyncio.Future]
+        self._inflight = {}  # type: Dict[str, asyncio.Future]
+        self._priority = None
+        self._task = None
+
+    async def get_parameters(self, parameter_ids: Iterable,
+                             priority: int = PRIORITY_NORMAL,
+                             fresh: bool = False):
+        """Retrieve parameters, joining the batch of any concurrent caller.
+
+        Fresh requests are sent on their own, so they never return data
+        requested before they were made.
+        """
+        if fresh:
+            return await self._async_fetch_fresh(list(parameter_ids),
+                                                 priority)
+
+        loop = asyncio.get_event_loop()
+        futures = {}
+        for parameter_id in parameter_ids:
+            key = str(parameter_id)
+            future = self._inflight.get(key) or self._pending.get(key)
+            if future is None:
+                future = loop.create_future()
+                self._pending[key] = future
+            futures[parameter_id] = future
+
+        if not futures:
+            return {}
+
+        if self._pending:
+            if self._priority is None or priority < self._priority:
+                self._priority = priority
+            if self._task is None:
+                self._task = loop.create_task(self._async_flush())
+
+        results = await asyncio.gather(
+            *[asyncio.shield(future) for future in futures.values()],
+            return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        return dict(zip(futures.keys(), results))
+
+    async def _async_flush(self):
+        """Send all pending requests in as few queries as possible."""
+        from nibeuplink import MAX_REQUEST_PARAMETERS
+
+        # yield to any other runnable that want to add requests
+        await asyncio.sleep(0)
+
+        pending, self._pending = self._pending, {}
+        priority, self._priority = self._priority, None
+        self._task = None
+        self._inflight.update(pending)
+
+        keys = list(pending.keys())
+        try:
+            for index in range(0, len(keys), MAX_REQUEST_PARAMETERS):
+                chunk = keys[index:index + MAX_REQUEST_PARAMETERS]
+                await self._async_fetch(chunk, pending, priority)
+        finally:
+            for key, future in pending.items():
+                if self._inflight.get(key) is future:
+                    del self._inflight[key]
+                if not future.done():
+                    future.cancel()
+
+    async def _async_fetch_fresh(self, parameter_ids, priority):
+        """Fetch parameters bypassing requests pending or in flight."""
+        from nibeuplink import MAX_REQUEST_PARAMETERS
+
+        keys = [str(parameter_id) for parameter_id in parameter_ids]
+        results = await asyncio.gather(*[
+            self._uplink.get_parameters(
+                self._system_id,
+                keys[index:index + MAX_REQUEST_PARAMETERS],
+                priority=priority,
+                fresh=True)
+            for index in range(0, len(keys), MAX_REQUEST_PARAMETERS)
+        ])
+        data = {}  # type: Dict[str, Dict]
+        for result in results:
+            data.update(result)
+        return {
+            parameter_id: data.get(key)
+            for parameter_id, key in zip(parameter_ids, keys)
+        }
+
+    async def _async_fetch(self, chunk, pending, priority):
+        """Fetch a single chunk of parameters."""
+        _LOGGER.debug("Requesting parameters %s on system %s",
+                      chunk, self._system_id)
+        try:
+            data = await self._uplink.get_parameters(self._system_id,
+                                                     chunk,
+                                                     priority=priority)
+        except Exception as exception:
+            for key in chunk:
+                self._inflight.pop(key, None)
+                pending[key].set_exception(exception)
+            return
+
+        for key in chunk:
+            self._inflight.pop(key, None)
+            pending[key].set_result(data.get(key))
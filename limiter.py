@@ -0,0 +1,123 @@
+"""Request rate limiting for nibe uplink."""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, List, Optional, Tuple  # noqa
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Return seconds to wait given a Retry-After header value."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+class NibeLimiter(object):
+    """Token bucket handing out request slots by priority.
+
+    Lower priority values are served first. Callers of equal priority
+    are served in the order they arrived.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        """Init with rate in requests per second."""
+        self._rate = rate
+        self._burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._blocked = 0.0
+        self._queue = []  # type: List[Tuple[int, int, asyncio.Future]]
+        self._counter = itertools.count()
+        self._handle = None
+
+    @property
+    def queue_depth(self) -> int:
+        """Return number of requests waiting for a slot."""
+        return sum(1 for _, _, future in self._queue if not future.done())
+
+    def queue_depths(self) -> Dict[int, int]:
+        """Return number of waiting requests per priority."""
+        depths = {}  # type: Dict[int, int]
+        for priority, _, future in self._queue:
+            if not future.done():
+                depths[priority] = depths.get(priority, 0) + 1
+        return depths
+
+    async def acquire(self, priority: int):
+        """Wait for a request slot."""
+        if not self._queue and self._take():
+            return
+
+        future = asyncio.get_event_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._counter), future))
+        self._schedule()
+        await future
+
+    def backoff(self, seconds: float):
+        """Hold all requests for a while, as requested by the server."""
+        _LOGGER.warning("Request rate exceeded, holding requests for %.0fs",
+                        seconds)
+        self._blocked = max(self._blocked, time.monotonic() + seconds)
+        self._tokens = 0.0
+        self._updated = self._blocked
+        if self._handle:
+            self._handle.cancel()
+            self._handle = None
+        self._schedule()
+
+    def _refill(self, now: float):
+        if now <= self._updated:
+            return
+        self._tokens = min(float(self._burst),
+                           self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    def _take(self) -> bool:
+        now = time.monotonic()
+        if now < self._blocked:
+            return False
+        self._refill(now)
+        if self._tokens < 1.0:
+            return False
+        self._tokens -= 1.0
+        return True
+
+    def _schedule(self):
+        if self._handle or not self._queue:
+            return
+        now = time.monotonic()
+        self._refill(now)
+        delay = max(self._blocked - now,
+                    (1.0 - self._tokens) / self._rate,
+                    0.0)
+        self._handle = asyncio.get_event_loop().call_later(delay, self._pump)
+
+    def _pump(self):
+        self._handle = None
+        while self._queue:
+            _, _, future = self._queue[0]
+            if future.done():
+                heapq.heappop(self._queue)
+                continue
+            if not self._take():
+                break
+            heapq.heappop(self._queue)
+            future.set_result(None)
+        self._schedule()
@@ -0,0 +1,135 @@
+"""Request metrics for nibe uplink."""
+
+import bisect
+import re
+from typing import Any, Dict, Optional, Tuple  # noqa
+
+ENDPOINTS = (
+    'get_parameters',
+    'get_system',
+    'get_status',
+    'get_unit_status',
+    'get_categories',
+    'get_notifications',
+    'put_parameters',
+    'put_smarthome_mode',
+    'post_smarthome_thermostats',
+)
+
+# endpoints by method and path below the system of uplink api urls
+ROUTES = {
+    ('GET', ''): 'get_system',
+    ('GET', '/parameters'): 'get_parameters',
+    ('GET', '/status/system'): 'get_status',
+    ('GET', '/status/systemUnit'): 'get_unit_status',
+    ('GET', '/serviceinfo/categories'): 'get_categories',
+    ('GET', '/notifications'): 'get_notifications',
+    ('PUT', '/parameters'): 'put_parameters',
+    ('PUT', '/smarthome/mode'): 'put_smarthome_mode',
+    ('POST', '/smarthome/thermostats'): 'post_smarthome_thermostats',
+}
+
+_SYSTEM_PATH = re.compile(r'/api/v1/systems/(\d+)(/.*)?')
+_UNIT_PATH = re.compile(r'(/status/systemUnit)/\d+')
+
+# upper bounds in seconds of latency histogram buckets
+BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, float('inf'))
+
+
+def classify(method: str, path: str) -> Tuple[Optional[int], Optional[str]]:
+    """Return system and endpoint of an uplink api request, if known."""
+    match = _SYSTEM_PATH.fullmatch(path)
+    if match is None:
+        return None, None
+    rest = match.group(2) or ''
+    unit = _UNIT_PATH.fullmatch(rest)
+    if unit is not None:
+        rest = unit.group(1)
+    return int(match.group(1)), ROUTES.get((method, rest))
+
+
+class EndpointMetrics(object):
+    """Counters and latency histogram of requests to one endpoint."""
+
+    __slots__ = ('requests', 'errors', 'total_time', 'histogram',
+                 'last_error')
+
+    def __init__(self):
+        """Init."""
+        self.requests = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.histogram = [0] * len(BUCKETS)
+        self.last_error = None  # type: Optional[str]
+
+    def record(self, seconds: float, error: Optional[str]):
+        """Record a completed request."""
+        self.requests += 1
+        self.total_time += seconds
+        self.histogram[bisect.bisect_left(BUCKETS, seconds)] += 1
+        if error is not None:
+            self.errors += 1
+            self.last_error = error
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        """Return upper bound of the bucket holding a percentile."""
+        if not self.requests:
+            return None
+        rank = fraction * self.requests
+        count = 0
+        for bound, bucket in zip(BUCKETS, self.histogram):
+            count += bucket
+            if count >= rank:
+                return bound
+        return BUCKETS[-1]
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Return metrics in a form suitable for dumping."""
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'mean': (self.total_time / self.requests
+                     if self.requests else None),
+            'p50': self.percentile(0.5),
+            'p99': self.percentile(0.99),
+            'histogram': {
+                str(bound): bucket
+                for bound, bucket in zip(BUCKETS, self.histogram)
+            },
+            'last_error': self.last_error,
+        }
+
+
+class NibeMetrics(object):
+    """Request metrics per system and endpoint.
+
+    Requests are timed from being sent until their response arrives, so
+    time spent waiting on a rate limit or throttle is not included.
+    """
+
+    def __init__(self):
+        """Init."""
+        self._metrics = {}  # type: Dict[Tuple[Any, str], EndpointMetrics]
+
+    def get(self, system_id, endpoint: str) -> EndpointMetrics:
+        """Return metrics of an endpoint of a system."""
+        key = (system_id, endpoint)
+        metrics = self._metrics.get(key)
+        if metrics is None:
+            metrics = EndpointMetrics()
+            self._metrics[key] = metrics
+        return metrics
+
+    def record(self, system_id, endpoint: str, seconds: float,
+               error: Optional[str] = None):
+        """Record a completed request."""
+        self.get(system_id, endpoint).record(seconds, error)
+
+    def dump(self) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        """Return all metrics by system and endpoint."""
+        result = {}  # type: Dict[str, Dict[str, Dict[str, Any]]]
+        for (system_id, endpoint), metrics in sorted(
+                self._metrics.items(), key=lambda x: str(x[0])):
+            result.setdefault(str(system_id), {})[endpoint] = \
+                metrics.as_dict()
+        return result
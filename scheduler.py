@@ -0,0 +1,114 @@
+"""Adaptive polling of parameters for nibe uplink."""
+
+import heapq
+import logging
+from typing import Dict, List, Optional, Tuple  # noqa
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class NibeScheduler(object):
+    """Decide when each parameter needs to be polled.
+
+    A parameter starts at the base interval. Each poll returning an
+    unchanged value doubles its interval up to the maximum, while a
+    changed value brings it back to the base interval.
+
+    Due times are kept on the monotonic clock in a heap, so finding the
+    parameters to poll does not need to look at the others. Entries are
+    not removed from the heap when rescheduled, instead stale entries are
+    skipped as they are popped.
+    """
+
+    def __init__(self, base: float, maximum: float):
+        """Init with intervals in seconds."""
+        self._base = base
+        self._maximum = max(base, maximum)
+        self._intervals = {}  # type: Dict[str, float]
+        self._due = {}  # type: Dict[str, float]
+        self._heap = []  # type: List[Tuple[float, str]]
+
+    def __contains__(self, key: str):
+        """Return if a parameter is scheduled."""
+        return key in self._due
+
+    def interval(self, key: str) -> float:
+        """Return current poll interval of a parameter."""
+        return self._intervals.get(key, self._base)
+
+    def observe(self, key: str, changed: bool) -> bool:
+        """Adjust interval of a parameter, return if it was changed."""
+        interval = self.interval(key)
+
+        if changed:
+            updated = self._base
+        else:
+            updated = min(interval * 2, self._maximum)
+
+        if updated == interval:
+            return False
+
+        _LOGGER.debug("Poll interval for %s changed to %ss", key, updated)
+        if updated == self._base:
+            del self._intervals[key]
+        else:
+            self._intervals[key] = updated
+        return True
+
+    def add(self, key: str, fetched: Optional[float], now: float):
+        """Start scheduling a parameter last fetched at given time."""
+        if key in self._due:
+            return
+        if fetched is None:
+            self._push(key, now)
+        else:
+            self._push(key, fetched + self.interval(key))
+
+    def remove(self, key: str):
+        """Stop scheduling a parameter."""
+        self._due.pop(key, None)
+
+    def schedule(self, key: str, now: float):
+        """Schedule next poll of a parameter received at given time."""
+        if key in self._due:
+            self._push(key, now + self.interval(key))
+
+    def pop_due(self, now: float) -> List[str]:
+        """Return parameters to poll now and schedule their next poll."""
+        # allow for jitter between update ticks
+        limit = now + self._base / 2
+        result = []
+        while self._heap and self._heap[0][0] <= limit:
+            due, key = heapq.heappop(self._heap)
+            if self._due.get(key) == due:
+                result.append(key)
+
+        # reschedule in case the poll fails
+        for key in result:
+            self._push(key, now + self.interval(key))
+        return result
+
+    def next_due(self) -> Optional[float]:
+        """Return time of next scheduled poll."""
+        while self._heap:
+            due, key = self._heap[0]
+            if self._due.get(key) == due:
+                return due
+            heapq.heappop(self._heap)
+        return None
+
+    def load(self, data: Optional[Dict[str, float]]):
+        """Restore intervals previously saved."""
+        if not data:
+            return
+        for key, interval in data.items():
+            if self._base < interval <= self._maximum:
+                self._intervals[key] = interval
+
+    def save(self) -> Dict[str, float]:
+        """Return intervals in a form suitable for storage."""
+        return dict(self._intervals)
+
+    def _push(self, key: str, due: float):
+        self._due[key] = due
+        heapq.heappush(self._heap, (due, key))
@@ -1,124 +1,271 @@
 """Sensors for nibe."""
 
 import asyncio
+import hashlib
+import json
 import logging
-from collections import defaultdict
-from typing import List
+from collections import OrderedDict
+from typing import Dict, Set, Tuple  # noqa
 
+from homeassistant.components.group import ATTR_ADD_ENTITIES, ATTR_OBJECT_ID
+from homeassistant.components.group import DOMAIN as DOMAIN_GROUP
+from homeassistant.components.group import SERVICE_SET
 from homeassistant.components.sensor import ENTITY_ID_FORMAT
 from homeassistant.core import split_entity_id
 from homeassistant.exceptions import PlatformNotReady
 from homeassistant.helpers.entity import Entity
 
 from .const import (CONF_CATEGORIES, CONF_SENSORS, CONF_STATUSES, CONF_UNIT,
-                    CONF_UNITS, DATA_NIBE)
+                    CONF_UNITS, DATA_NIBE, SETUP_PARALLEL, SETUP_TIMEOUT,
+                    STORAGE_KEY_CATALOGUE, STORAGE_VERSION)
 from .const import DOMAIN as DOMAIN_NIBE
 from .entity import NibeParameterEntity
+from .metrics import ENDPOINTS
+from .session import async_get_metrics
 
 DEPENDENCIES = ['nibe']
 PARALLEL_UPDATES = 0
 _LOGGER = logging.getLogger(__name__)
 
 
-def gen_dict():
-    """Generate a default dict."""
-    return {'groups': [], 'data': None}
+META_KEYS = ('parameterId', 'name', 'title', 'designation', 'unit')
 
 
-async def async_load(hass, uplink):
-    """Load the sensors."""
+def _catalogue_hash(groups) -> str:
+    """Return a hash of catalogue metadata, stable between restarts."""
+    data = json.dumps(groups, sort_keys=True).encode()
+    return hashlib.sha1(data).hexdigest()
+
+
+def _catalogue_groups(groups):
+    """Strip values from groups, leaving only metadata."""
+    return [
+        {
+            'name': group['name'],
+            'object_id': group['object_id'],
+            'parameters': [
+                {key: parameter.get(key) for key in META_KEYS}
+                for parameter in group['parameters']
+            ],
+        }
+        for group in groups
+    ]
+
+
+async def async_setup_entry(hass, entry, async_add_entities):
+    """Set up the device based on a config entry."""
     if DATA_NIBE not in hass.data:
         raise PlatformNotReady
 
+    uplink = hass.data[DATA_NIBE]['uplink']
     systems = hass.data[DATA_NIBE]['systems']
+    loader = NibeSensorLoader(hass, uplink, entry, async_add_entities)
+
+    async_add_entities([
+        NibeMetricSensor(async_get_metrics(hass), system.system_id,
+                         endpoint)
+        for system in systems.values()
+        for endpoint in ENDPOINTS
+    ], False)
+
+    await asyncio.gather(*[
+        loader.async_load(system) for system in systems.values()
+    ])
+
+
+class NibeSensorLoader(object):
+    """Create sensors for the parameters of configured systems.
+
+    Titles, units and grouping of the parameters of each unit are kept
+    in storage. On later starts entities are created from storage right
+    away, and the catalogue is revalidated against uplink in background.
+    """
+
+    def __init__(self, hass, uplink, entry, async_add_entities):
+        """Init."""
+        self._hass = hass
+        self._uplink = uplink
+        self._entry = entry
+        self._async_add_entities = async_add_entities
+        self._semaphore = asyncio.Semaphore(SETUP_PARALLEL)
+        self._groups = {}  # type: Dict[Tuple[int, str], str]
+        self._sensors = set()  # type: Set[Tuple[int, str]]
 
-    sensors = defaultdict(gen_dict)
-    group = hass.components.group
-
-    async def load_parameter_group(name: str,
-                                   system_id: int,
-                                   object_id: str,
-                                   parameters: List[dict]):
-
-        entity = await group.Group.async_create_group(
-            hass,
-            name=name,
-            control=False,
-            object_id='{}_{}_{}'.format(DOMAIN_NIBE, system_id, object_id))
-
-        _, group_id = split_entity_id(entity.entity_id)
-
-        for x in parameters:
-            entry = sensors[(system_id, x['parameterId'])]
-            entry['data'] = x
-            entry['groups'].append(group_id)
-            _LOGGER.debug("Entry {}".format(entry))
-
-    async def load_sensor(system_id, sensor_id):
-        sensors.setdefault((system_id, sensor_id), gen_dict())
-
-    async def load_categories(system_id, unit_id):
-        data = await uplink.get_categories(system_id, True, unit_id)
-        tasks = [
-            load_parameter_group(
-                x['name'],
-                system_id,
-                '{}_{}'.format(unit_id, x['categoryId']),
-                x['parameters'])
-            for x in data
-        ]
-        await asyncio.gather(*tasks)
-
-    async def load_statuses(system_id, unit_id):
-        data = await uplink.get_unit_status(system_id, unit_id)
-        tasks = [
-            load_parameter_group(
-                x['title'],
-                system_id,
-                '{}_{}'.format(unit_id, x['title']),
-                x['parameters'])
-            for x in data
-        ]
-        await asyncio.gather(*tasks)
-
-    for system in systems.values():
-        for sensor_id in system.config[CONF_SENSORS]:
-            await load_sensor(system.system_id, sensor_id)
+    async def async_load(self, system):
+        """Load sensors of a system."""
+        store = self._hass.helpers.storage.Store(
+            STORAGE_VERSION,
+            STORAGE_KEY_CATALOGUE.format(system.system_id))
+        catalogue = await store.async_load() or {}
 
+        groups = []
+        stored = []
+        missing = []
         for unit in system.config[CONF_UNITS]:
-            if unit[CONF_CATEGORIES]:
-                await load_categories(system.system_id, unit[CONF_UNIT])
+            for kind in (CONF_CATEGORIES, CONF_STATUSES):
+                if not unit[kind]:
+                    continue
+                key = '{}_{}'.format(kind, unit[CONF_UNIT])
+                if key in catalogue:
+                    stored.append((kind, unit[CONF_UNIT]))
+                    groups.extend(catalogue[key]['groups'])
+                else:
+                    missing.append((kind, unit[CONF_UNIT]))
 
-            if unit[CONF_STATUSES]:
-                await load_statuses(system.system_id, unit[CONF_UNIT])
-    return sensors
+        for group in groups:
+            system.cache.seed(group['parameters'])
 
+        if await self._async_update_catalogue(system, catalogue, missing,
+                                              groups.extend):
+            await store.async_save(catalogue)
 
-async def async_setup_entry(hass, entry, async_add_entities):
-    """Set up the device based on a config entry."""
-    uplink = hass.data[DATA_NIBE]['uplink']
-    sensors = await async_load(hass, uplink)
-    entites_update = []
-    entites_done = []
-    for (system_id, parameter_id), config in sensors.items():
-        if parameter_id == 0:
-            continue
-
-        entity = NibeSensor(
-            uplink,
-            system_id,
-            parameter_id,
-            entry,
-            data=config['data'],
-            groups=config.get('groups', [])
-        )
-        if config['data']:
-            entites_done.append(entity)
-        else:
-            entites_update.append(entity)
-
-    async_add_entities(entites_update, True)
-    async_add_entities(entites_done, False)
+        await self._async_add(system, groups, system.config[CONF_SENSORS])
+
+        if stored:
+            self._hass.async_create_task(
+                self._async_revalidate(system, store, catalogue, stored))
+
+    async def _async_revalidate(self, system, store, catalogue, units):
+        """Refresh stored catalogue, adding sensors for new parameters."""
+        groups = []
+        if await self._async_update_catalogue(system, catalogue, units,
+                                              groups.extend):
+            _LOGGER.info("Catalogue of system %s changed", system.system_id)
+            await store.async_save(catalogue)
+            await self._async_add(system, groups)
+
+    async def _async_update_catalogue(self, system, catalogue, units,
+                                      callback) -> bool:
+        """Fetch groups of units into catalogue, return if it changed."""
+        tasks = {
+            asyncio.ensure_future(
+                self._async_fetch(system.system_id, kind, unit_id)):
+            '{}_{}'.format(kind, unit_id)
+            for kind, unit_id in units
+        }
+        if not tasks:
+            return False
+
+        done, pending = await asyncio.wait(tasks, timeout=SETUP_TIMEOUT)
+        for task in pending:
+            _LOGGER.error("Timeout loading %s of system %s",
+                          tasks[task], system.system_id)
+            task.cancel()
+
+        changed = False
+        for task in done:
+            if task.exception():
+                _LOGGER.error("Error loading %s of system %s: %s",
+                              tasks[task], system.system_id,
+                              task.exception())
+                continue
+
+            groups = task.result()
+            system.parameters_received({
+                parameter['parameterId']: parameter
+                for group in groups
+                for parameter in group['parameters']
+            })
+
+            metadata = _catalogue_groups(groups)
+            digest = _catalogue_hash(metadata)
+            stored = catalogue.get(tasks[task])
+            if stored and stored['hash'] == digest:
+                continue
+
+            catalogue[tasks[task]] = {
+                'hash': digest,
+                'groups': metadata,
+            }
+            callback(groups)
+            changed = True
+        return changed
+
+    async def _async_fetch(self, system_id, kind, unit_id):
+        """Fetch groups of parameters of a unit."""
+        async with self._semaphore:
+            if kind == CONF_CATEGORIES:
+                data = await self._uplink.get_categories(
+                    system_id, True, unit_id)
+                return [
+                    {
+                        'name': x['name'],
+                        'object_id': '{}_{}'.format(unit_id,
+                                                    x['categoryId']),
+                        'parameters': x['parameters'] or [],
+                    }
+                    for x in data
+                ]
+            else:
+                data = await self._uplink.get_unit_status(system_id, unit_id)
+                return [
+                    {
+                        'name': x['title'],
+                        'object_id': '{}_{}'.format(unit_id, x['title']),
+                        'parameters': x['parameters'] or [],
+                    }
+                    for x in data
+                ]
+
+    async def _async_group(self, system_id, group, entity_ids):
+        """Create group if needed, or add entities to the existing one."""
+        key = (system_id, group['object_id'])
+        if key not in self._groups:
+            entity = await self._hass.components.group.Group.\
+                async_create_group(
+                    self._hass,
+                    name=group['name'],
+                    entity_ids=entity_ids,
+                    control=False,
+                    object_id='{}_{}_{}'.format(DOMAIN_NIBE,
+                                                system_id,
+                                                group['object_id']))
+            _, self._groups[key] = split_entity_id(entity.entity_id)
+        elif entity_ids:
+            await self._hass.services.async_call(
+                DOMAIN_GROUP, SERVICE_SET, {
+                    ATTR_OBJECT_ID: self._groups[key],
+                    ATTR_ADD_ENTITIES: entity_ids
+                }
+            )
+
+    async def _async_add(self, system, groups, sensor_ids=()):
+        """Add sensors for parameters not yet having one.
+
+        Membership of all groups is known before any sensor is added, so
+        each group is created or extended with a single call.
+        """
+        parameter_ids = OrderedDict()  # type: Dict[str, None]
+        for sensor_id in sensor_ids:
+            parameter_ids[str(sensor_id)] = None
+        for group in groups:
+            for parameter in group['parameters']:
+                parameter_ids[str(parameter['parameterId'])] = None
+
+        entities = {}  # type: Dict[str, NibeSensor]
+        for parameter_id in parameter_ids:
+            key = (system.system_id, parameter_id)
+            if parameter_id == '0' or key in self._sensors:
+                continue
+            self._sensors.add(key)
+
+            entities[parameter_id] = NibeSensor(
+                self._uplink,
+                system.system_id,
+                parameter_id,
+                self._entry
+            )
+
+        await asyncio.gather(*[
+            self._async_group(system.system_id, group, [
+                entities[str(parameter['parameterId'])].entity_id
+                for parameter in group['parameters']
+                if str(parameter['parameterId']) in entities
+            ])
+            for group in groups
+        ])
+
+        self._async_add_entities(list(entities.values()), False)
 
 
 class NibeSensor(NibeParameterEntity, Entity):
@@ -128,18 +275,67 @@ class NibeSensor(NibeParameterEntity, Entity):
                  uplink,
                  system_id,
                  parameter_id,
-                 entry,
-                 data,
-                 groups):
+                 entry):
         """Init."""
         super(NibeSensor, self).__init__(uplink,
                                          system_id,
                                          parameter_id,
-                                         data,
-                                         groups,
                                          ENTITY_ID_FORMAT)
 
     @property
     def state(self):
         """Return the state of the sensor."""
         return self._value
+
+
+class NibeMetricSensor(Entity):
+    """Requests made to an uplink endpoint for a system."""
+
+    def __init__(self, metrics, system_id, endpoint):
+        """Init."""
+        self._metrics = metrics
+        self._system_id = system_id
+        self._endpoint = endpoint
+        self.entity_id = ENTITY_ID_FORMAT.format(
+            '{}_{}_requests_{}'.format(DOMAIN_NIBE, system_id, endpoint))
+
+    @property
+    def name(self):
+        """Return the name of the sensor."""
+        return 'Nibe {} {} requests'.format(self._system_id, self._endpoint)
+
+    @property
+    def unique_id(self):
+        """Return a unique identifier for this sensor."""
+        return '{}_requests_{}'.format(self._system_id, self._endpoint)
+
+    @property
+    def device_info(self):
+        """Return device identifier."""
+        return {
+            'identifiers': {(DOMAIN_NIBE, self._system_id)},
+        }
+
+    @property
+    def icon(self):
+        """Return icon."""
+        return 'mdi:counter'
+
+    @property
+    def unit_of_measurement(self):
+        """Return the unit of measurement."""
+        return 'requests'
+
+    @property
+    def state(self):
+        """Return number of requests made."""
+        return self._metrics.get(self._system_id, self._endpoint).requests
+
+    @property
+    def device_state_attributes(self):
+        """Return errors and latency of requests."""
+        metrics = self._metrics.get(self._system_id, self._endpoint)
+        data = metrics.as_dict()
+        del data['requests']
+        del data['histogram']
+        return data
@@ -0,0 +1,102 @@
+"""HTTP connection pool for nibe uplink."""
+
+import logging
+import time
+
+import aiohttp
+
+from homeassistant.const import EVENT_HOMEASSISTANT_CLOSE
+from homeassistant.core import callback
+
+from .const import (CONF_CONNECTION_LIMIT, CONF_KEEPALIVE_TIMEOUT,
+                    CONF_REQUEST_TIMEOUT, DATA_NIBE, DNS_CACHE_TTL)
+from .metrics import NibeMetrics, classify
+
+_LOGGER = logging.getLogger(__name__)
+
+# default headers of the session nibeuplink creates itself
+HEADERS = {
+    'Accept': 'application/json',
+    'Content-Type': 'application/x-www-form-urlencoded;charset=UTF-8',
+}
+
+
+@callback
+def async_get_connector(hass) -> aiohttp.TCPConnector:
+    """Return the connection pool, kept until home assistant closes."""
+    connector = hass.data[DATA_NIBE].get('connector')
+    if connector:
+        return connector
+
+    config = hass.data[DATA_NIBE]['config']
+    connector = aiohttp.TCPConnector(
+        limit=config[CONF_CONNECTION_LIMIT],
+        limit_per_host=config[CONF_CONNECTION_LIMIT],
+        keepalive_timeout=config[CONF_KEEPALIVE_TIMEOUT],
+        ttl_dns_cache=DNS_CACHE_TTL)
+    hass.data[DATA_NIBE]['connector'] = connector
+
+    async def close(event):
+        await connector.close()
+
+    hass.bus.async_listen_once(EVENT_HOMEASSISTANT_CLOSE, close)
+    return connector
+
+
+@callback
+def async_get_metrics(hass) -> NibeMetrics:
+    """Return metrics of the requests sent over the connection pool."""
+    metrics = hass.data[DATA_NIBE].get('metrics')
+    if metrics is None:
+        metrics = NibeMetrics()
+        hass.data[DATA_NIBE]['metrics'] = metrics
+    return metrics
+
+
+def _trace_config(metrics: NibeMetrics) -> aiohttp.TraceConfig:
+    """Return a trace config recording requests to systems in metrics."""
+    def record(context, params, error):
+        system_id, endpoint = classify(params.method, params.url.path)
+        if endpoint is None:
+            return
+        metrics.record(system_id, endpoint,
+                       time.monotonic() - context.started, error)
+
+    async def on_request_start(session, context, params):
+        context.started = time.monotonic()
+
+    async def on_request_end(session, context, params):
+        status = params.response.status
+        record(context, params,
+               'HTTP {}'.format(status) if status >= 400 else None)
+
+    async def on_request_exception(session, context, params):
+        record(context, params, type(params.exception).__name__)
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_request_end.append(on_request_end)
+    trace_config.on_request_exception.append(on_request_exception)
+    return trace_config
+
+
+async def async_use_session(hass, uplink, client_id, client_secret):
+    """Make an uplink client send its requests over the connection pool.
+
+    The client creates a session of its own, which is replaced with one
+    sharing the pool and sending the same default headers. Closing the
+    client then leaves the pool open. Requests are recorded in metrics.
+    """
+    config = hass.data[DATA_NIBE]['config']
+    session = aiohttp.ClientSession(
+        connector=async_get_connector(hass),
+        connector_owner=False,
+        headers=HEADERS,
+        trace_configs=[_trace_config(async_get_metrics(hass))],
+        auth=aiohttp.BasicAuth(client_id, client_secret),
+        timeout=aiohttp.ClientTimeout(total=config[CONF_REQUEST_TIMEOUT]))
+
+    previous = getattr(uplink, 'session', None)
+    uplink.session = session
+    if previous is not None:
+        await previous.close()
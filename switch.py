@@ -32,7 +32,7 @@ async def async_setup_entry(hass, entry, async_add_entities):
                 )
             )
 
-    async_add_entities(entities, True)
+    async_add_entities(entities, False)
 
 
 class NibeSwitch(NibeParameterEntity, SwitchDevice):
@@ -48,27 +48,21 @@ class NibeSwitch(NibeParameterEntity, SwitchDevice):
             uplink,
             system_id,
             parameter_id,
-            None,
-            [],
             ENTITY_ID_FORMAT)
 
     @property
     def is_on(self):
         """Return if entity is on."""
-        data = self._parameters[self._parameter_id]
+        data = self.get_data(self._parameter_id)
         if data:
-            return data['rawValue'] == "1"
+            return data.raw_value == "1"
         else:
             return None
 
     async def async_turn_on(self, **kwargs):
         """Turn entity on."""
-        await self._uplink.put_parameter(self._system_id,
-                                         self._parameter_id,
-                                         '1')
+        self.system.writer.async_write(self._parameter_id, '1')
 
     async def async_turn_off(self, **kwargs):
         """Turn entity off."""
-        await self._uplink.put_parameter(self._system_id,
-                                         self._parameter_id,
-                                         '0')
+        self.system.writer.async_write(self._parameter_id, '0')
@@ -0,0 +1,107 @@
+"""Smart thermostat publishing for nibe uplink."""
+
+import asyncio
+import logging
+import time
+from datetime import datetime  # noqa
+from typing import Dict, Optional, Set, Tuple  # noqa
+
+from homeassistant.core import callback
+from homeassistant.util import dt as dt_util
+
+from .const import THERMOSTAT_DEBOUNCE, THERMOSTAT_MAX_AGE
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class NibeThermostatPublisher(object):
+    """Publish the smart thermostats of a system.
+
+    Thermostats that changed are published together once changes have
+    settled for a while. Payloads equal to the last one published are
+    skipped, unless it was published longer ago than the maximum age.
+    """
+
+    def __init__(self, hass, uplink, system_id: int):
+        """Init."""
+        self._hass = hass
+        self._uplink = uplink
+        self._system_id = system_id
+        self._thermostats = {}  # type: Dict[int, object]
+        self._published = {}  # type: Dict[int, Tuple[Tuple, float]]
+        self._last_published = {}  # type: Dict[int, datetime]
+        self._pending = set()  # type: Set[int]
+        self._handle = None
+
+    @callback
+    def async_add(self, thermostat):
+        """Start publishing a thermostat, publishing it soon."""
+        external_id = thermostat.external_id
+        self._thermostats[external_id] = thermostat
+        self.async_publish_later(external_id)
+
+        @callback
+        def remove():
+            self._thermostats.pop(external_id, None)
+            self._pending.discard(external_id)
+            if not self._thermostats and self._handle:
+                self._handle.cancel()
+                self._handle = None
+
+        return remove
+
+    def last_published(self, external_id: int) -> Optional[datetime]:
+        """Return when a thermostat was last published successfully."""
+        return self._last_published.get(external_id)
+
+    @callback
+    def async_publish_later(self, external_id: int):
+        """Publish a thermostat once changes have settled for a while."""
+        self._pending.add(external_id)
+        if self._handle:
+            self._handle.cancel()
+        self._handle = self._hass.loop.call_later(
+            THERMOSTAT_DEBOUNCE, self._publish_pending)
+
+    @callback
+    def _publish_pending(self):
+        self._handle = None
+        self._hass.async_create_task(self.async_publish())
+
+    async def async_publish(self):
+        """Publish thermostats that changed or are due for keepalive."""
+        pending, self._pending = self._pending, set()
+        now = time.monotonic()
+
+        due = {}
+        for external_id, thermostat in self._thermostats.items():
+            payload, data = thermostat.publish_data()
+            published, published_time = self._published.get(
+                external_id, (None, None))
+            if published is not None and \
+                    now < published_time + THERMOSTAT_MAX_AGE and \
+                    (payload == published or external_id not in pending):
+                continue
+            due[external_id] = (payload, data)
+
+        if not due:
+            return
+
+        _LOGGER.debug("Publish thermostats %s of system %s",
+                      list(due.keys()), self._system_id)
+        results = await asyncio.gather(*[
+            self._uplink.post_smarthome_thermostats(self._system_id, data)
+            for _, data in due.values()
+        ], return_exceptions=True)
+
+        for (external_id, (payload, _)), result in zip(due.items(),
+                                                       results):
+            if isinstance(result, Exception):
+                _LOGGER.error("Error publishing thermostat %s: %s",
+                              external_id, result)
+                # retry with the next update instead of at maximum age
+                if external_id in self._thermostats:
+                    self._pending.add(external_id)
+                continue
+            self._published[external_id] = (payload, now)
+            self._last_published[external_id] = dt_util.utcnow()
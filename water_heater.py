@@ -1,12 +1,9 @@
 """Water heater entity for nibe uplink."""
 
-import asyncio
 import logging
 from collections import OrderedDict
 from typing import Set
 
-import aiohttp
-
 from homeassistant.components.water_heater import (ENTITY_ID_FORMAT, STATE_ECO,
                                                    STATE_HEAT_PUMP,
                                                    STATE_HIGH_DEMAND,
@@ -17,6 +14,7 @@ from homeassistant.exceptions import PlatformNotReady
 
 from .const import CONF_WATER_HEATERS, DATA_NIBE
 from .const import DOMAIN as DOMAIN_NIBE
+from .discovery import NibeDiscovery
 from .entity import NibeEntity
 
 DEPENDENCIES = ['nibe']
@@ -65,39 +63,37 @@ async def async_setup_entry(hass, entry, async_add_entities):
     uplink = hass.data[DATA_NIBE]['uplink']
     systems = hass.data[DATA_NIBE]['systems']
 
-    entities = []
-
     from nibeuplink import (PARAM_HOTWATER_SYSTEMS)
 
     async def is_active(system, hwsys):
         if not system.config[CONF_WATER_HEATERS]:
             return False
 
-        available = await uplink.get_parameter(
-            system.system_id,
-            hwsys.hot_water_production)
-        if available and available['rawValue']:
+        data = await system.get_parameters(
+            [hwsys.hot_water_production])
+        available = data[hwsys.hot_water_production]
+        if available and available.raw_value:
             return True
         return False
 
-    async def add_active(system, hwsys):
-        if await is_active(system, hwsys):
-            entities.append(
-                NibeWaterHeater(
-                    uplink,
-                    system.system_id,
-                    system.statuses,
-                    hwsys,
-                )
+    def create(system, hwsys):
+        return [
+            NibeWaterHeater(
+                uplink,
+                system.system_id,
+                system.statuses,
+                hwsys,
             )
+        ]
 
-    await asyncio.gather(*[
-        add_active(system, hwsys)
-        for hwsys in PARAM_HOTWATER_SYSTEMS.values()
-        for system in systems.values()
-    ])
-
-    async_add_entities(entities, True)
+    discovery = NibeDiscovery(hass,
+                              entry,
+                              CONF_WATER_HEATERS,
+                              PARAM_HOTWATER_SYSTEMS,
+                              is_active,
+                              create,
+                              async_add_entities)
+    await discovery.async_load(systems.values())
 
 
 class NibeWaterHeater(NibeEntity, WaterHeaterDevice):
@@ -111,8 +107,7 @@ class NibeWaterHeater(NibeEntity, WaterHeaterDevice):
         """Init."""
         super().__init__(
             uplink,
-            system_id,
-            [])
+            system_id)
 
         self._name = hwsys.name
         self._current_operation = STATE_OFF
@@ -148,9 +143,9 @@ class NibeWaterHeater(NibeEntity, WaterHeaterDevice):
     @property
     def temperature_unit(self):
         """Return temperature unit."""
-        data = self._parameters[self._hwsys.hot_water_charging]
+        data = self.get_data(self._hwsys.hot_water_charging)
         if data:
-            return data['unit']
+            return data.unit
         else:
             return None
 
@@ -235,22 +230,17 @@ class NibeWaterHeater(NibeEntity, WaterHeaterDevice):
 
     async def async_set_operation_mode(self, operation_mode):
         """Set new target operation mode."""
-        try:
-            if operation_mode in HA_STATE_TO_NIBE:
-                    await self._uplink.put_parameter(
-                        self._system_id,
-                        self._hwsys.hot_water_comfort_mode,
-                        HA_STATE_TO_NIBE[operation_mode])
-            elif operation_mode in HA_BOOST_TO_NIBE:
-                    await self._uplink.put_parameter(
-                        self._system_id,
-                        self._hwsys.hot_water_boost,
-                        HA_BOOST_TO_NIBE[operation_mode])
-            else:
-                _LOGGER.error("Operation mode %s not supported",
-                              operation_mode)
-        except aiohttp.client_exceptions.ClientResponseError as e:
-            _LOGGER.error("Error trying to set mode %s", str(e))
+        if operation_mode in HA_STATE_TO_NIBE:
+            self.system.writer.async_write(
+                self._hwsys.hot_water_comfort_mode,
+                HA_STATE_TO_NIBE[operation_mode])
+        elif operation_mode in HA_BOOST_TO_NIBE:
+            self.system.writer.async_write(
+                self._hwsys.hot_water_boost,
+                HA_BOOST_TO_NIBE[operation_mode])
+        else:
+            _LOGGER.error("Operation mode %s not supported",
+                          operation_mode)
 
     @property
     def unique_id(self):
@@ -258,16 +248,10 @@ class NibeWaterHeater(NibeEntity, WaterHeaterDevice):
         return "{}_{}".format(self._system_id,
                               self._hwsys.hot_water_charging)
 
-    async def async_update(self):
-        """Update entity."""
-        _LOGGER.debug("Update water heater {}".format(self.name))
-        await super().async_update()
-        self.parse_data()
-
     async def async_statuses_updated(self, statuses: Set[str]):
         """React to statuses updated."""
         self.parse_statuses(statuses)
-        self.async_schedule_update_ha_state()
+        self.async_schedule_update_if_changed()
 
     def parse_statuses(self, statuses: Set[str]):
         """Parse status values."""
@@ -285,9 +269,9 @@ class NibeWaterHeater(NibeEntity, WaterHeaterDevice):
             operation = STATE_OFF
         self._current_state = operation
 
-        boost = self._parameters[self._hwsys.hot_water_boost]
+        boost = self.get_data(self._hwsys.hot_water_boost)
         if boost:
-            value = boost['rawValue']
+            value = boost.raw_value
             if value != 0:
                 operation = NIBE_BOOST_TO_STATE.get(
                     value, 'boost_{}'.format(value))
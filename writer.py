@@ -0,0 +1,219 @@
+"""Write-behind of parameters for nibe uplink."""
+
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Set, Tuple  # noqa
+
+import aiohttp
+
+from homeassistant.core import callback
+
+from .cache import ParameterRecord  # noqa
+from .const import (PRIORITY_HIGH, WRITE_DELAY, WRITE_PARALLEL,
+                    WRITE_RETRIES, WRITE_RETRY_DELAY, WRITE_STATUS_DONE)
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class NibeWriteError(Exception):
+    """Uplink did not accept a parameter value."""
+
+
+class NibeWriter(object):
+    """Write parameters of a system in the background.
+
+    Written values are applied to the cache right away. Writes made to a
+    parameter while waiting are coalesced, so only the latest value is
+    sent. Parameters queued together are sent in a single request, and
+    only count as written when uplink reports them done. If the final
+    write of a parameter fails, it is rolled back to the value it had
+    before. Once written, a parameter is read back along with the
+    parameters the pump derives from it. Values received for parameters
+    being written are ignored, so they do not undo the optimistic ones.
+    """
+
+    def __init__(self, hass, system):
+        """Init."""
+        self._hass = hass
+        self._system = system
+        self._pending = OrderedDict()  # type: Dict[str, Tuple]
+        self._futures = {}  # type: Dict[str, List[asyncio.Future]]
+        self._original = {}  # type: Dict[str, Optional[ParameterRecord]]
+        self._inflight = set()  # type: Set[str]
+        self._dependents = {}  # type: Dict[str, Set[str]]
+        self._derived = {}  # type: Dict[str, Set[str]]
+        self._semaphore = asyncio.Semaphore(WRITE_PARALLEL)
+        self._handle = None
+
+        from nibeuplink import PARAM_CLIMATE_SYSTEMS
+        for climate in PARAM_CLIMATE_SYSTEMS.values():
+            self.add_dependents(climate.offset_heat,
+                                [climate.calc_supply_temp_heat])
+            self.add_dependents(climate.offset_cool,
+                                [climate.calc_supply_temp_cool])
+
+    @property
+    def queue_depth(self) -> int:
+        """Return number of parameters waiting to be written."""
+        return len(self._pending) + len(self._inflight)
+
+    def busy(self, parameter_id) -> bool:
+        """Return if a parameter has an optimistic value not yet written."""
+        return str(parameter_id) in self._original
+
+    def add_dependents(self, parameter_id, dependents: Iterable):
+        """Read back dependents whenever a parameter has been written."""
+        self._dependents.setdefault(str(parameter_id), set()).update(
+            str(dependent) for dependent in dependents)
+
+    @callback
+    def async_write(self, parameter_id, value,
+                    derived: Dict = None) -> asyncio.Future:
+        """Queue a write, returning a future for the uplink status.
+
+        Derived maps dependent parameters to the values the pump will
+        give them, applied along with the written value until read back.
+        """
+        key = str(parameter_id)
+        values = {key: value}
+        for dependent, dependent_value in (derived or {}).items():
+            values[str(dependent)] = dependent_value
+        self._derived.setdefault(key, set()).update(values.keys() - {key})
+
+        written = {}
+        for value_key, new_value in values.items():
+            record = self._system.cache.get(value_key)
+            if value_key not in self._original:
+                self._original[value_key] = record
+            if record is not None:
+                written[value_key] = record.written(new_value)
+        if written:
+            self._system.parameters_written(written)
+
+        self._pending[key] = (parameter_id, value, written)
+        self._pending.move_to_end(key)
+
+        future = self._hass.loop.create_future()
+        # callers need not wait on the write, so never warn on its result
+        future.add_done_callback(
+            lambda future: future.cancelled() or future.exception())
+        self._futures.setdefault(key, []).append(future)
+
+        self._schedule()
+        return future
+
+    def _schedule(self):
+        if self._handle:
+            self._handle.cancel()
+        self._handle = self._hass.loop.call_later(WRITE_DELAY, self._flush)
+
+    @callback
+    def _flush(self):
+        self._handle = None
+        batch = OrderedDict()  # type: Dict[str, Tuple]
+        futures = {}  # type: Dict[str, List[asyncio.Future]]
+        for key in list(self._pending.keys()):
+            if key in self._inflight:
+                continue
+            batch[key] = self._pending.pop(key)
+            futures[key] = self._futures.pop(key, [])
+            self._inflight.add(key)
+        if batch:
+            self._hass.async_create_task(self._async_write(batch, futures))
+
+    async def _async_put(self, settings: Dict[str, str]) -> Dict[str, str]:
+        """Write parameters in one request, retrying on errors."""
+        attempt = 0
+        while True:
+            try:
+                return await self._system.uplink.put_parameters(
+                    self._system.system_id, settings)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as exception:
+                if attempt >= WRITE_RETRIES:
+                    raise
+                _LOGGER.warning("Error writing parameters %s, retrying: %s",
+                                list(settings.keys()), exception)
+                await asyncio.sleep(WRITE_RETRY_DELAY * 2 ** attempt)
+                attempt += 1
+
+    async def _async_write(self, batch, futures):
+        """Write parameters, rolling back those whose final write failed.
+
+        A successful write that is followed by another becomes the value
+        to roll back to, should the later one fail.
+        """
+        settings = OrderedDict(
+            (str(parameter_id), str(value))
+            for parameter_id, value, _ in batch.values())
+        try:
+            async with self._semaphore:
+                statuses = await self._async_put(settings)
+        except Exception as exception:
+            results = {key: exception for key in batch}
+        else:
+            results = {}
+            for key, (parameter_id, _, _) in batch.items():
+                status = statuses.get(str(parameter_id))
+                if status == WRITE_STATUS_DONE:
+                    results[key] = status
+                else:
+                    results[key] = NibeWriteError(
+                        'Uplink answered {}'.format(status))
+
+        read_back = []
+        for key, (parameter_id, value, written) in batch.items():
+            self._inflight.discard(key)
+            result = results[key]
+            if isinstance(result, Exception):
+                _LOGGER.error(
+                    "Error writing %s to parameter %s of system %s: %s",
+                    value, parameter_id, self._system.system_id, result)
+                self._failed(key)
+                for future in futures[key]:
+                    if not future.done():
+                        future.set_exception(result)
+                continue
+
+            _LOGGER.debug("Wrote %s to parameter %s: %s",
+                          value, parameter_id, result)
+            if key in self._pending:
+                self._original.update(written)
+            else:
+                for value_key in self._release(key):
+                    self._original.pop(value_key, None)
+                read_back.extend([key, *self._dependents.get(key, ())])
+            for future in futures[key]:
+                if not future.done():
+                    future.set_result(result)
+
+        if read_back:
+            self._hass.async_create_task(self._async_read_back(read_back))
+        if self._pending:
+            self._schedule()
+
+    def _failed(self, key: str):
+        """Roll back a parameter unless another write of it is pending."""
+        if key in self._pending:
+            return
+        originals = {}
+        for value_key in self._release(key):
+            original = self._original.pop(value_key, None)
+            if original is not None:
+                originals[value_key] = original
+        if originals:
+            self._system.parameters_written(originals)
+
+    def _release(self, key: str) -> Set[str]:
+        """Return a written parameter and those derived by its writes."""
+        return {key} | self._derived.pop(key, set())
+
+    async def _async_read_back(self, parameter_ids):
+        """Fetch written parameters again to confirm their values."""
+        try:
+            await self._system.get_parameters(parameter_ids,
+                                              force=True,
+                                              priority=PRIORITY_HIGH)
+        except Exception as exception:
+            _LOGGER.warning("Error reading back parameters %s: %s",
+                            parameter_ids, exception)